@@ -0,0 +1,197 @@
+import asyncio
+import collections
+import queue
+import threading
+import time
+
+import torch
+
+from concurrent.futures import Future
+from easydict import EasyDict
+from faust import Faust
+
+
+class ApplyService:
+    """Streaming application of a Faust to incoming signals.
+
+    service = ApplyService(F) starts worker threads applying the Faust F
+    (or the cell-array of factors F) to the signals submitted to it:
+    service.submit(x) returns a concurrent.futures.Future of F*x for a
+    vector x (n) or a matrix x (n*k) of k signals, and
+    await service.apply_async(x) is its asyncio counterpart.
+
+    The signals received while a worker is busy are coalesced into
+    micro-batches of at most max_batch columns, a batch being sent as soon
+    as it is full or max_delay seconds after its first signal. Each batch
+    goes through the factors from the right to the left, the intermediate
+    products being written into two buffers preallocated per worker and
+    sized by the largest dimension of the chain, so that nothing but the
+    results is allocated per request.
+
+    Optional arguments:
+    --------------------------
+
+    'max_batch' - Maximal number of columns of a micro-batch. The default
+        value is 64. Larger requests are applied alone, by chunks of
+        max_batch columns.
+
+    'max_delay' - Maximal time in seconds a signal waits for others to fill
+        its micro-batch. The default value is 1e-3.
+
+    'n_workers' - Number of worker threads, each applying its own
+        micro-batches. The default value is 1.
+
+    service.stats() returns the counters of the service: number of
+    requests, columns and batches, mean batch size, throughput in columns
+    per second and latencies (mean, median and 99th percentile in seconds,
+    over the last 10000 requests). The service is stopped by close(), or
+    used as a context manager.
+    """
+
+    def __init__(self, F, max_batch=64, max_delay=1e-3, n_workers=1):
+        if not isinstance(F, Faust):
+            F = Faust(F)
+        self.F = F
+        self.facts = F.facts
+        self.lambda_ = F.lambda_
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        m, n = F.shape
+        self.shape = (m, n)
+        self.max_dim = max([n] + [fact.size(0) for fact in self.facts])
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=10000)
+        self._counts = EasyDict(n_requests=0, n_columns=0, n_batches=0)
+        self._start = time.perf_counter()
+        self._closed = False
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(n_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, x):
+        """Future of F*x for a vector or matrix x."""
+        if self._closed:
+            raise Exception('The apply service is closed')
+        if x.size(0) != self.shape[1]:
+            raise Exception(f'Size incompatibility: the operator has {self.shape[1]} columns, x has {x.size(0)} rows')
+        future = Future()
+        self._queue.put((x, future, time.perf_counter()))
+        return future
+
+    async def apply_async(self, x):
+        return await asyncio.wrap_future(self.submit(x))
+
+    def apply(self, x):
+        return self.submit(x).result()
+
+    def close(self):
+        """Stops the workers once the submitted requests are processed."""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        with self._lock:
+            stats = EasyDict(self._counts)
+            latencies = sorted(self._latencies)
+        elapsed = time.perf_counter() - self._start
+        stats.mean_batch = stats.n_columns / max(stats.n_batches, 1)
+        stats.throughput = stats.n_columns / elapsed
+        if latencies:
+            stats.latency_mean = sum(latencies) / len(latencies)
+            stats.latency_p50 = latencies[len(latencies) // 2]
+            stats.latency_p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+        return stats
+
+    def _columns(self, x):
+        return 1 if x.ndim == 1 else x.size(1)
+
+    def _work(self):
+        size = self.max_dim * self.max_batch
+        buffers = [torch.empty(size, dtype=self.F.dtype, device=self.F.device) for _ in range(2)]
+        pending, stop = None, False
+        while not stop:
+            # First request of the batch, then the ones arriving within max_delay
+            item = pending if pending is not None else self._queue.get()
+            pending = None
+            if item is None:
+                return
+            batch, b = [item], self._columns(item[0])
+            deadline = time.perf_counter() + self.max_delay
+            while b < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Stop once the current batch is applied
+                    stop = True
+                    break
+                if b + self._columns(item[0]) > self.max_batch:
+                    pending = item
+                    break
+                batch.append(item)
+                b += self._columns(item[0])
+
+            try:
+                results = self._apply_batch(batch, b, buffers)
+            except Exception as error:
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                continue
+            now = time.perf_counter()
+            for (_, future, _), y in zip(batch, results):
+                future.set_result(y)
+            with self._lock:
+                self._counts.n_requests += len(batch)
+                self._counts.n_columns += b
+                self._counts.n_batches += 1
+                self._latencies.extend(now - t0 for _, _, t0 in batch)
+
+    def _chain(self, x, buffers):
+        """F*x for a matrix x of at most max_batch columns, written into one
+        of the buffers."""
+        b = x.size(1)
+        h = x
+        for k, fact in enumerate(reversed(self.facts)):
+            out = buffers[k % 2][:fact.size(0) * b].view(fact.size(0), b)
+            h = torch.mm(fact, h, out=out)
+        return h.mul_(self.lambda_)
+
+    def _apply_batch(self, batch, b, buffers):
+        """Results of the requests of batch (b columns in total)."""
+        n = self.shape[1]
+        if b > self.max_batch:
+            # Single request larger than a micro-batch
+            x = batch[0][0].to(dtype=self.F.dtype, device=self.F.device)
+            return [torch.cat([
+                self._chain(x[:, start:start+self.max_batch].contiguous(), buffers).clone()
+                for start in range(0, b, self.max_batch)
+            ], 1)]
+        # Input packed in the buffer which is not written by the first factor
+        inp = buffers[1][:n * b].view(n, b)
+        col = 0
+        for x, _, _ in batch:
+            k = self._columns(x)
+            inp[:, col:col+k].copy_(x.reshape(n, k))
+            col += k
+        y = self._chain(inp, buffers)
+        results, col = [], 0
+        for x, _, _ in batch:
+            k = self._columns(x)
+            results.append(y[:, col].clone() if x.ndim == 1 else y[:, col:col+k].clone())
+            col += k
+        return results
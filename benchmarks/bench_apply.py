@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import torch
+from faust import Faust
+from apply_service import ApplyService
+from utils.support import Support
+
+
+def butterfly_faust(n):
+    """Faust of the log2(n) random butterfly factors of size n."""
+    p = n.bit_length() - 1
+    facts = [Support.butterfly(n, level).scatter(torch.randn(2 * n)) for level in range(p, 0, -1)]
+    return Faust(facts, sparse_threshold=0.5)
+
+
+def percentile(latencies, q):
+    latencies = sorted(latencies)
+    return latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+
+
+def run_clients(apply, signals):
+    """Each client applies its signals one after the other; returns the
+    throughput (signals/s) and the latencies of the requests."""
+    latencies = [[] for _ in signals]
+
+    def client(c):
+        for x in signals[c]:
+            start = time.perf_counter()
+            apply(x)
+            latencies[c].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(len(signals))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = [t for client_latencies in latencies for t in client_latencies]
+    return len(latencies) / elapsed, latencies
+
+
+def check_close(F, n_workers, timeout=5.):
+    """Closing the service right after submitting signals (while a worker
+    is filling a micro-batch) must apply them and return."""
+    service = ApplyService(F, max_batch=8, max_delay=0.5, n_workers=n_workers)
+    futures = [service.submit(torch.randn(F.size(1))) for _ in range(3)]
+    closer = threading.Thread(target=service.close, daemon=True)
+    closer.start()
+    closer.join(timeout)
+    if closer.is_alive():
+        raise SystemExit(f'ApplyService.close() with {n_workers} workers did not return within {timeout} s')
+    for future in futures:
+        future.result(0)
+
+
+def report(name, throughput, latencies):
+    print(f'{name:28s} {throughput:12.0f} signals/s   latency p50 {percentile(latencies, 0.5)*1e3:7.3f} ms'
+          f'   p99 {percentile(latencies, 0.99)*1e3:7.3f} ms')
+
+
+def main():
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    F = butterfly_faust(args.size)
+    W = F.todense()
+    print(f'{F}, {args.clients} clients, {torch.get_num_threads()} threads')
+    for n_workers in sorted({1, args.workers, 2}):
+        check_close(F, n_workers)
+    n_per_client = args.n_requests // args.clients
+    signals = [[torch.randn(args.size) for _ in range(n_per_client)] for _ in range(args.clients)]
+
+    with torch.inference_mode():
+        report('dense matvec', *run_clients(lambda x: W @ x, signals))
+        report('faust per request', *run_clients(lambda x: F @ x, signals))
+        for max_batch in args.max_batch:
+            with ApplyService(F, max_batch, args.max_delay, args.workers) as service:
+                throughput, latencies = run_clients(service.apply, signals)
+                stats = service.stats()
+            report(f'service batch <= {max_batch}', throughput, latencies)
+            print(f'{"":28s} mean batch {stats.mean_batch:.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=4096, help='Size of the operator (power of 2)')
+    parser.add_argument('--n_requests', type=int, default=4000, help='Total number of signals')
+    parser.add_argument('--clients', type=int, default=32, help='Number of concurrent clients')
+    parser.add_argument('--max_batch', type=int, nargs='+', default=[8, 32], help='Micro-batch sizes')
+    parser.add_argument('--max_delay', type=float, default=2e-4, help='Maximal wait for a micro-batch (s)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker threads of the service')
+    parser.add_argument('--threads', type=int, default=1, help='Number of torch threads')
+    args = parser.parse_args()
+    main()
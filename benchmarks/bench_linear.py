@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import torch
+from torch import nn
+from compress import FaustLinear, linear_constraints
+
+
+def random_factors(m, n, n_facts, rcg):
+    """Random factors with the supports sizes chosen by compress_linear."""
+    cons = linear_constraints(m, n, n_facts, rcg)
+    shapes = [cons[0][k][1:] for k in range(n_facts-1)] + [cons[1][-1][1:]]
+    facts = []
+    for s, p, q in shapes:
+        fact = torch.zeros(p * q)
+        fact[torch.randperm(p * q)[:s]] = torch.randn(s)
+        facts.append(fact.view(p, q))
+    return facts
+
+
+def n_bytes(module):
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+
+def timeit(fn, n_repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(n_repeat):
+        fn()
+    return (time.perf_counter() - start) / n_repeat
+
+
+def main():
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    dense = nn.Linear(args.size, args.size)
+    print(f'{args.size}x{args.size}, {args.n_facts} factors, {torch.get_num_threads()} threads')
+    print(f'dense         {n_bytes(dense) / 2**20:8.2f} MB')
+    layers = {}
+    for rcg in args.rcg:
+        layers[rcg] = FaustLinear(random_factors(args.size, args.size, args.n_facts, rcg), 1., dense.bias)
+        print(f'faust rcg {rcg:<4g}{n_bytes(layers[rcg]) / 2**20:8.2f} MB')
+    with torch.inference_mode():
+        for batch in args.batch:
+            x = torch.randn(batch, args.size)
+            t_dense = timeit(lambda: dense(x), args.n_repeat)
+            line = f'batch {batch:5d}   dense {batch / t_dense:12.0f} samples/s'
+            for rcg, layer in layers.items():
+                t = timeit(lambda: layer(x), args.n_repeat)
+                line += f'   rcg {rcg:g} {batch / t:12.0f} samples/s (x{t_dense / t:4.2f})'
+            print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=2048, help='Input and output features of the layer')
+    parser.add_argument('--n_facts', type=int, default=3, help='Number of factors')
+    parser.add_argument('--rcg', type=float, nargs='+', default=[4., 16.], help='Relative complexity gains')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 32, 256], help='Batch sizes')
+    parser.add_argument('--threads', type=int, default=1, help='Number of threads')
+    parser.add_argument('--n_repeat', type=int, default=20, help='Number of timed repetitions')
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import torch
+import hierarchical as hierarchical_module
+from easydict import EasyDict
+from hierarchical import hierarchical
+from utils.general import check_precision
+
+
+def spy_split_dtypes(dtypes):
+    """Records the dtypes of the factors of the 2-factorisations run by
+    hierarchical."""
+    palm4msa = hierarchical_module.palm4msa
+
+    def spy(params):
+        result = palm4msa(params)
+        if params.n_facts == 2:
+            dtypes.update(fact.dtype for fact in result[1])
+        return result
+    hierarchical_module.palm4msa = spy
+
+
+def main():
+    torch.manual_seed(0)
+    n = args.size
+    # Product of random sparse factors, so that the factorization can fit it
+    X = torch.eye(n, dtype=torch.float64)
+    for _ in range(args.n_facts):
+        X = X @ (torch.randn(n, n, dtype=torch.float64) * (torch.rand(n, n) < args.density))
+    s = round(args.density * n * n)
+    cons = [
+        [['sp', s, n, n]] * (args.n_facts-1),
+        [['sp', s, n, n]] * (args.n_facts-1),
+    ]
+    results = {}
+    split_dtypes = set()
+    spy_split_dtypes(split_dtypes)
+    for precision in ['double', 'single', 'bfloat16']:
+        params = EasyDict(
+            data=X.clone(),
+            n_facts=args.n_facts,
+            cons=cons,
+            n_iter1=args.n_iter,
+            n_iter2=args.n_iter,
+            precision=precision,
+        )
+        split_dtypes.clear()
+        start = time.perf_counter()
+        _, _, errors = hierarchical(params)
+        elapsed = time.perf_counter() - start
+        # The 2-factorisations must run in the precision policy too
+        dtype, _ = check_precision(precision)
+        if split_dtypes != {dtype}:
+            raise SystemExit(f'{precision}: the 2-factorisations returned factors of types {split_dtypes}')
+        results[precision] = errors[:, 0].double()
+        gap = (results[precision] - results['double']).abs().max()
+        print(f'{precision:9s} {elapsed:8.2f} s   final error {float(errors[-1, 0]):.6f}   '
+              f'max gap to double {float(gap):.2e}')
+    # Relative errors of reduced precisions should stay close to float64
+    gap = (results['single'] - results['double']).abs().max()
+    if gap > args.tol:
+        raise SystemExit(f'single precision errors deviate from double by {float(gap):.2e} > {args.tol}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=256, help='Size of the factorized matrix')
+    parser.add_argument('--n_facts', type=int, default=4, help='Number of factors')
+    parser.add_argument('--density', type=float, default=0.05, help='Density of the factors')
+    parser.add_argument('--n_iter', type=int, default=50, help='PALM iterations per stage')
+    parser.add_argument('--tol', type=float, default=1e-2, help='Allowed gap of the single precision errors')
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import torch
+from proxs import prox_sp, prox_spcol, prox_splin, prox_sp_pos
+
+
+# Sort-based projections, as they were before the partial-selection rewrite
+def prox_sp_sort(X, s):
+    Xprox = torch.zeros_like(X)
+    _, sorted_index = torch.sort(X.abs().view(-1), descending=True)
+    max_index = sorted_index[:round(min(s, X.numel()))]
+    Xprox.view(-1)[max_index] = X.view(-1)[max_index]
+    return Xprox / torch.linalg.norm(Xprox, 'fro')
+
+
+def prox_spcol_sort(X, s):
+    Xprox = torch.zeros_like(X)
+    _, sorted_index = torch.sort(X.abs(), dim=0, descending=True)
+    max_index = sorted_index[:round(s), :]
+    col_index = torch.arange(X.size(1)).expand_as(max_index)
+    Xprox[max_index, col_index] = X[max_index, col_index]
+    return Xprox / torch.linalg.norm(Xprox, 'fro')
+
+
+def prox_splin_sort(X, s):
+    return prox_spcol_sort(X.T, s).T
+
+
+def prox_sp_pos_sort(X, s):
+    Xpos = X * (X > 0)
+    return prox_sp_sort(Xpos / torch.linalg.norm(Xpos, 'fro'), s)
+
+
+def timeit(fn, n_repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(n_repeat):
+        fn()
+    return (time.perf_counter() - start) / n_repeat
+
+
+def main():
+    torch.manual_seed(0)
+    X = torch.randn(args.size, args.size, dtype=torch.float64)
+    out = torch.empty_like(X)
+    s_mat = round(args.density * X.numel())
+    s_vec = max(1, round(args.density * args.size))
+    cases = [
+        ('sp', prox_sp_sort, prox_sp, s_mat),
+        ('spcol', prox_spcol_sort, prox_spcol, s_vec),
+        ('splin', prox_splin_sort, prox_splin, s_vec),
+        ('sppos', prox_sp_pos_sort, prox_sp_pos, s_mat),
+    ]
+    print(f'{args.size}x{args.size}, density {args.density}, {torch.get_num_threads()} threads')
+    for name, old, new, s in cases:
+        t_old = timeit(lambda: old(X, s), args.n_repeat)
+        t_new = timeit(lambda: new(X, s, out), args.n_repeat)
+        print(f'{name:6s} sort {t_old*1e3:9.2f} ms   topk {t_new*1e3:9.2f} ms   x{t_old/t_new:5.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=4096, help='Size of the projected matrices')
+    parser.add_argument('--density', type=float, default=0.02, help='Fraction of kept entries')
+    parser.add_argument('--n_repeat', type=int, default=5, help='Number of timed repetitions')
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import multiprocessing
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import torch
+from easydict import EasyDict
+from palm4msa import palm4msa
+from hierarchical import hierarchical
+from proxs import prox_sp, prox_spcol, prox_splin, prox_normcol, prox_normlin, prox_sp_pos, prox_supp
+from utils import dvp, grad_comp, mult_left, mult_right
+from utils.support import Support
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+# Test operators
+def hadamard(n):
+    H = torch.ones(1, 1, dtype=torch.float64)
+    while H.size(0) < n:
+        H = torch.kron(torch.tensor([[1., 1.], [1., -1.]], dtype=torch.float64), H)
+    return H
+
+
+def gaussian(n):
+    gen = torch.Generator().manual_seed(0)
+    return torch.randn(n, n, generator=gen, dtype=torch.float64)
+
+
+def dft_real(n):
+    """Real n*n embedding [[Re(F), -Im(F)], [Im(F), Re(F)]] of the DFT of size n/2."""
+    F = torch.fft.fft(torch.eye(n // 2, dtype=torch.complex128))
+    return torch.cat([torch.cat([F.real, -F.imag], 1), torch.cat([F.imag, F.real], 1)], 0)
+
+
+OPERATORS = {'hadamard': hadamard, 'gaussian': gaussian, 'dft_real': dft_real}
+
+
+def sparse_facts(n, n_facts, density):
+    gen = torch.Generator().manual_seed(1)
+    return [torch.randn(n, n, generator=gen, dtype=torch.float64) * (torch.rand(n, n, generator=gen) < density)
+            for _ in range(n_facts)]
+
+
+def n_levels(n):
+    return max(n.bit_length() - 1, 2)
+
+
+def rcg(X, facts):
+    return X.numel() / sum(int(torch.count_nonzero(fact)) for fact in facts)
+
+
+def rel_error(X, lambda_, facts):
+    return float(torch.linalg.norm(X - lambda_ * dvp(facts)) / torch.linalg.norm(X))
+
+
+# Each benchmark returns the timed function, and the function giving the
+# relative error and RCG of its result (None for the kernels)
+def bench_palm4msa(X, n_iter):
+    n = X.size(0)
+    cons = [['sp', n*n // 4, n, n], ['sp', n*n // 4, n, n]]
+
+    def run():
+        params = EasyDict(
+            data=X.clone(), n_facts=2, cons=cons, n_iter=n_iter,
+            init_facts=[torch.zeros(n, n, dtype=torch.float64), torch.eye(n, dtype=torch.float64)],
+        )
+        return palm4msa(params)
+    return run, lambda result: (rel_error(X, *result), rcg(X, result[1]))
+
+
+def bench_hierarchical(X, n_iter):
+    n = X.size(0)
+    p = n_levels(n)
+    cons = [
+        [['sp', 2*n, n, n]] * (p-1),
+        [['sp', max(n*n // 2**(k+1), 2*n), n, n] for k in range(p-1)],
+    ]
+
+    def run():
+        params = EasyDict(data=X.clone(), n_facts=p, cons=cons, n_iter1=n_iter, n_iter2=n_iter)
+        lambda_, facts, _ = hierarchical(params)
+        return lambda_, facts
+    return run, lambda result: (rel_error(X, *result), rcg(X, result[1]))
+
+
+def bench_prox(prox, s):
+    def bench(X, n_iter):
+        out = torch.empty_like(X)
+        return lambda: prox(X, s(X), out), None
+    return bench
+
+
+def bench_grad_comp(X, n_iter):
+    L, S, R = sparse_facts(X.size(0), 3, 0.05)
+    return lambda: grad_comp([L], S, [R], X, 1.5), None
+
+
+def bench_dvp(X, n_iter):
+    facts = sparse_facts(X.size(0), n_levels(X.size(0)), 0.05)
+    return lambda: dvp(facts), None
+
+
+def bench_mult_left(X, n_iter):
+    facts = sparse_facts(X.size(0), n_levels(X.size(0)), 0.05)
+    return lambda: mult_left(facts, X), None
+
+
+def bench_mult_right(X, n_iter):
+    facts = sparse_facts(X.size(0), n_levels(X.size(0)), 0.05)
+    return lambda: mult_right(X, facts), None
+
+
+BENCHES = {
+    'palm4msa': bench_palm4msa,
+    'hierarchical': bench_hierarchical,
+    'prox_sp': bench_prox(prox_sp, lambda X: X.numel() // 20),
+    'prox_spcol': bench_prox(prox_spcol, lambda X: max(X.size(0) // 20, 1)),
+    'prox_splin': bench_prox(prox_splin, lambda X: max(X.size(1) // 20, 1)),
+    'prox_normcol': bench_prox(prox_normcol, lambda X: 1.),
+    'prox_normlin': bench_prox(prox_normlin, lambda X: 1.),
+    'prox_sppos': bench_prox(prox_sp_pos, lambda X: X.numel() // 20),
+    'prox_supp': bench_prox(prox_supp, lambda X: Support.butterfly(X.size(0), 1).index),
+    'grad_comp': bench_grad_comp,
+    'dvp': bench_dvp,
+    'mult_left': bench_mult_left,
+    'mult_right': bench_mult_right,
+}
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(case):
+    """Times one case, in its own process so that its peak memory is its own."""
+    torch.set_num_threads(case['threads'])
+    torch.manual_seed(0)
+    X = OPERATORS[case['op']](case['size'])
+    fn, quality = BENCHES[case['bench']](X, case['n_iter'])
+    rss = max_rss_mb()
+    result = fn()
+    times = []
+    for _ in range(case['n_repeat']):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    record = dict(case, time=times[len(times) // 2], mem_mb=max(max_rss_mb() - rss, 0.))
+    if quality is not None:
+        record['rel_error'], record['rcg'] = quality(result)
+    return record
+
+
+def case_key(case):
+    return f'{case["bench"]}/{case["op"]}/n={case["size"]}/t={case["threads"]}'
+
+
+def compare(results, baseline):
+    """Regressions of results with respect to baseline: time above the
+    baseline by more than tol_time (relative), or error above it by more
+    than tol_err."""
+    regressions = []
+    for key, record in results.items():
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        if record['time'] > base['time'] * (1 + args.tol_time) + args.min_time:
+            regressions.append(f'{key}: time {record["time"]*1e3:.2f} ms > baseline {base["time"]*1e3:.2f} ms')
+        if 'rel_error' in base and record['rel_error'] > base['rel_error'] + args.tol_err:
+            regressions.append(f'{key}: error {record["rel_error"]:.6f} > baseline {base["rel_error"]:.6f}')
+    return regressions
+
+
+def main():
+    benches = args.bench or list(BENCHES)
+    ops = args.op or list(OPERATORS)
+    cases = []
+    for threads in args.threads:
+        for size in args.sizes:
+            for bench in benches:
+                # Kernels do not depend on the operator, they are run on the first one
+                for op in (ops if bench in ('palm4msa', 'hierarchical') else ops[:1]):
+                    n_repeat = 1 if bench in ('palm4msa', 'hierarchical') else args.n_repeat
+                    cases.append(dict(bench=bench, op=op, size=size, threads=threads,
+                                      n_iter=args.n_iter, n_repeat=n_repeat))
+
+    results = {}
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        for record in pool.imap(run_case, cases):
+            key = case_key(record)
+            results[key] = record
+            line = f'{key:40s} {record["time"]*1e3:10.2f} ms {record["mem_mb"]:8.1f} MB'
+            if 'rel_error' in record:
+                line += f'   error {record["rel_error"]:.4f}   rcg {record["rcg"]:.2f}'
+            print(line, flush=True)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1)
+        return
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[128, 256], help='Sizes of the operators')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1], help='Numbers of threads')
+    parser.add_argument('--bench', nargs='+', choices=list(BENCHES), help='Benchmarks to run (default: all)')
+    parser.add_argument('--op', nargs='+', choices=list(OPERATORS), help='Test operators (default: all)')
+    parser.add_argument('--n_iter', type=int, default=20, help='PALM iterations per run')
+    parser.add_argument('--n_repeat', type=int, default=5, help='Timed repetitions of the kernels')
+    parser.add_argument('--out', help='JSON file where the results are written')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline JSON the results are compared to')
+    parser.add_argument('--save_baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--tol_time', type=float, default=0.3, help='Allowed relative slowdown')
+    parser.add_argument('--min_time', type=float, default=1e-3, help='Allowed absolute slowdown in seconds')
+    parser.add_argument('--tol_err', type=float, default=1e-3, help='Allowed increase of the relative errors')
+    args = parser.parse_args()
+    main()
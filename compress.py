@@ -0,0 +1,207 @@
+import torch
+
+from torch import nn
+from easydict import EasyDict
+from faust import Faust
+from hierarchical import hierarchical
+from utils import dvp
+from utils.sparse import to_dense
+
+
+class FaustLinear(nn.Module):
+    """Linear layer whose weight is a product of sparse factors.
+
+    layer = FaustLinear(facts, lambda_, bias) computes
+    y = x*W' + bias with W = lambda_*facts{1}*...*facts{n}, applying the
+    factors in sequence as CSR matrices: the cost and memory of the layer
+    are those of the non-zero entries. The values of the factors are the
+    parameters of the layer (the scalar is folded into the first factor),
+    their supports are fixed buffers: training the layer fine-tunes the
+    values on fixed supports.
+    """
+
+    def __init__(self, facts, lambda_=1., bias=None):
+        super().__init__()
+        facts = [to_dense(fact).detach() for fact in facts]
+        facts[0] = lambda_ * facts[0]
+        self.in_features = facts[-1].size(1)
+        self.out_features = facts[0].size(0)
+        self.shapes = [tuple(fact.shape) for fact in facts]
+        self.values = nn.ParameterList()
+        for j, fact in enumerate(facts):
+            csr = fact.to_sparse_csr()
+            self.register_buffer(f'crow_indices_{j}', csr.crow_indices().to(torch.int32))
+            self.register_buffer(f'col_indices_{j}', csr.col_indices().to(torch.int32))
+            self.values.append(nn.Parameter(csr.values().clone()))
+        if bias is None:
+            self.register_parameter('bias', None)
+        else:
+            self.bias = nn.Parameter(bias.detach().clone())
+
+    @classmethod
+    def from_linear(cls, linear, facts, lambda_=1.):
+        """FaustLinear replacing linear, whose weight is approximated by
+        lambda_*facts{1}*...*facts{n}."""
+        dtype = linear.weight.dtype
+        layer = cls([to_dense(fact).to(dtype) for fact in facts], float(lambda_), linear.bias)
+        return layer.to(linear.weight.device)
+
+    def factors(self):
+        """Factors of the weight, as CSR tensors."""
+        return [
+            torch.sparse_csr_tensor(
+                getattr(self, f'crow_indices_{j}'), getattr(self, f'col_indices_{j}'), values, shape)
+            for j, (values, shape) in enumerate(zip(self.values, self.shapes))
+        ]
+
+    def to_faust(self):
+        return Faust([fact.detach() for fact in self.factors()])
+
+    def weight(self):
+        """Developed weight (out_features*in_features)."""
+        return dvp(self.factors(), self.values[0].device)
+
+    def nnz(self):
+        return sum(values.numel() for values in self.values)
+
+    def rcg(self):
+        return self.in_features * self.out_features / self.nnz()
+
+    def forward(self, x):
+        h = x.reshape(-1, self.in_features).T
+        for fact in reversed(self.factors()):
+            h = fact @ h
+        y = h.T.reshape(*x.shape[:-1], self.out_features)
+        if self.bias is not None:
+            y = y + self.bias
+        return y
+
+    def extra_repr(self):
+        return f'in_features={self.in_features}, out_features={self.out_features}, ' \
+            f'n_facts={len(self.shapes)}, rcg={self.rcg():.2f}'
+
+
+def linear_constraints(m, n, n_facts, rcg):
+    """Constraints of hierarchical for an m*n weight factorized into n_facts
+    factors of sizes m*d, d*d, ..., d*n (d = min(m,n)) with a total of
+    m*n/rcg non-zero entries, shared in proportion to the sizes of the
+    factors. The residuals get a density halved at each level."""
+    d = min(m, n)
+    shapes = [(m, d)] + [(d, d)] * (n_facts-2) + [(d, n)]
+    budget = m * n / rcg
+    total = sum(p * q for p, q in shapes)
+    s = [max(round(p * q * budget / total), 1) for p, q in shapes]
+    cons = [[], []]
+    for k in range(n_facts-1):
+        p, q = shapes[k]
+        cons[0].append(['sp', s[k], p, q])
+        size = q * n
+        cons[1].append(['sp', min(size, max(s[-1], round(size * 0.5**(k+1)))), q, n])
+    cons[1][-1] = ['sp', s[-1], d, n]
+    return cons
+
+
+def factorize_weight(W, n_facts=3, rcg=4., n_iter=100, **params):
+    """Factorization of the weight W with hierarchical for the target rcg,
+    returning lambda, facts and the relative error. params are passed to
+    hierarchical."""
+    m, n = W.shape
+    params = EasyDict(params)
+    params.data = W.detach().to(torch.float64)
+    params.n_facts = n_facts
+    params.cons = linear_constraints(m, n, n_facts, rcg)
+    params.n_iter1 = params.get('n_iter1', n_iter)
+    params.n_iter2 = params.get('n_iter2', n_iter)
+    lambda_, facts, errors = hierarchical(params)
+    return lambda_, facts, float(errors[-1, 0])
+
+
+def _finetune(layer, inputs, targets, n_steps, lr):
+    optimizer = torch.optim.Adam(layer.parameters(), lr=lr)
+    for _ in range(n_steps):
+        optimizer.zero_grad()
+        loss = nn.functional.mse_loss(layer(inputs), targets)
+        loss.backward()
+        optimizer.step()
+    return loss.item()
+
+
+def compress_linear(model, names=None, rcg=4., error=None, rcg_grid=(16., 8., 4., 2.), n_facts=3,
+                    n_iter=100, min_features=64, calib=None, finetune_steps=0, lr=1e-3, **params):
+    """Replacement of the nn.Linear layers of model by FaustLinear layers.
+
+    report = compress_linear(model) factorizes the weight of each selected
+    nn.Linear of model with hierarchical and replaces the layer by a
+    FaustLinear, in place. report maps the name of each selected layer to
+    its 'rcg', relative error 'rel_error' and whether it was 'replaced'.
+
+    Optional arguments:
+    --------------------------
+
+    'names' - Names of the layers to compress (as in model.named_modules()).
+        By default, all the nn.Linear layers with at least min_features
+        input and output features.
+
+    'rcg' - Target Relative Complexity Gain (dense size / number of non-zero
+        entries) of the factorized weights. The default value is 4.
+
+    'error' - Error budget. If given, each weight is factorized with the
+        RCG of rcg_grid in decreasing order and the first one whose relative
+        error is at most error is kept; the layer is left dense if there is
+        none.
+
+    'n_facts', 'n_iter' - Number of factors and PALM iterations per stage
+        of hierarchical. Other keyword arguments are fields of the params
+        of hierarchical (e.g. device, precision, lipschitz, tol_obj), see
+        its documentation.
+
+    'calib', 'finetune_steps', 'lr' - If calib (an input batch of model)
+        is given and finetune_steps > 0, the inputs of the selected layers
+        on calib are recorded, and the values of the factors of each new
+        layer are fine-tuned (Adam, supports fixed) to reproduce the outputs
+        of the dense layer.
+    """
+    layers = {
+        name: module for name, module in model.named_modules()
+        if isinstance(module, nn.Linear) and (
+            name in names if names is not None else
+            min(module.in_features, module.out_features) >= min_features)
+    }
+
+    # Inputs of the layers on the calibration batch
+    inputs = {}
+    if calib is not None and finetune_steps > 0:
+        hooks = [
+            module.register_forward_hook(
+                lambda module, args, output, name=name: inputs.__setitem__(name, args[0].detach()))
+            for name, module in layers.items()
+        ]
+        with torch.no_grad():
+            model(calib)
+        for hook in hooks:
+            hook.remove()
+
+    report = {}
+    for name, linear in layers.items():
+        grid = [rcg] if error is None else sorted(rcg_grid, reverse=True)
+        for target in grid:
+            lambda_, facts, rel_error = factorize_weight(linear.weight, n_facts, target, n_iter, **params)
+            if error is None or rel_error <= error:
+                break
+        else:
+            report[name] = EasyDict(rcg=1., rel_error=0., replaced=False)
+            continue
+
+        layer = FaustLinear.from_linear(linear, facts, lambda_)
+        if name in inputs:
+            with torch.no_grad():
+                targets = linear(inputs[name])
+            _finetune(layer, inputs[name], targets, finetune_steps, lr)
+            with torch.no_grad():
+                W = linear.weight
+                rel_error = float(torch.linalg.norm(layer.weight() - W) / torch.linalg.norm(W))
+
+        parent_name, _, child_name = name.rpartition('.')
+        setattr(model.get_submodule(parent_name), child_name, layer)
+        report[name] = EasyDict(rcg=layer.rcg(), rel_error=rel_error, replaced=True)
+    return report
@@ -0,0 +1,51 @@
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import torch
+from hierarchical import hierarchical
+from easydict import EasyDict
+from faust import Faust
+
+
+def main():
+    # Hadamard matrix of size n = 2^p
+    p = args.p
+    n = 2**p
+    H = torch.ones(1, 1, dtype=torch.float64)
+    for _ in range(p):
+        H = torch.kron(torch.tensor([[1., 1.], [1., -1.]], dtype=torch.float64), H)
+
+    # Butterfly supports for the factors, decreasing sparsity for the residuals
+    cons = [
+        [['butterfly', k+1, n, n] for k in range(p-1)],
+        [['sp', n*n // 2**(k+1), n, n] for k in range(p-1)],
+    ]
+    cons[1][-1] = ['butterfly', p, n, n]
+    params = EasyDict(
+        data=H,
+        n_facts=p,
+        cons=cons,
+        n_iter1=args.n_iter,
+        n_iter2=args.n_iter,
+        verbose=args.verbose,
+    )
+    lambda_, facts, errors = hierarchical(params)
+    print('errors', errors)
+
+    # Sparse factors: the operator is applied in O(n log n)
+    F = Faust(facts, lambda_, sparse_threshold=1)
+    x = torch.randn(n, dtype=torch.float64)
+    print('nnz', F.nnz(), 'rcg', F.rcg())
+    print('apply error', float(torch.linalg.vector_norm(F @ x - H @ x) / torch.linalg.vector_norm(H @ x)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--p', type=int, default=6, help='Log2 of the size of the Hadamard matrix')
+    parser.add_argument('--n_iter', type=int, default=100, help='PALM iterations per stage')
+    parser.add_argument('--verbose', action='store_true', help='Verbose')
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,199 @@
+import torch
+
+from easydict import EasyDict
+from utils import dvp, nnzero_count
+from utils.chain_order import chain_plan, chain_prod, chain_signature
+from utils.sparse import adjoint, sparsify, transpose
+
+
+class Faust:
+    """Flexible Approximate MUlti-layer Sparse Transform.
+
+    F = Faust(facts, lambda_) wraps the factors facts and the multiplicative
+    scalar lambda_ returned by hierarchical (or palm4msa) into a linear
+    operator F = lambda_*facts{1}*...*facts{n}. F @ x and x @ F apply the
+    factors in factorized form, in the cheapest order for the number of
+    columns of x, unless developing the product once is cheaper (see
+    _apply).
+
+    Optional arguments:
+    --------------------------
+
+    'sparse_threshold' - Factors whose density is lower than
+        sparse_threshold are stored in a sparse format. The default value is
+        0 (factors are kept as given).
+
+    'sparse_format' - Sparse format of the factors, 'csr' or 'coo'. The
+        default value is 'csr'.
+    """
+
+    def __init__(self, facts, lambda_=1., sparse_threshold=0, sparse_format='csr'):
+        if len(facts) == 0:
+            raise Exception('A Faust needs at least one factor')
+        for i in range(1, len(facts)):
+            if facts[i-1].size(1) != facts[i].size(0):
+                raise Exception(f'Size incompatibility between factors {i-1} and {i}')
+        self._facts = [sparsify(fact, sparse_threshold, sparse_format) for fact in facts]
+        self._loader = None
+        self._shape = None
+        self._nnz = None
+        self._n_facts = None
+        self.lambda_ = lambda_.item() if torch.is_tensor(lambda_) else lambda_
+        self._dense = None
+        self.meta = EasyDict()
+
+    @classmethod
+    def lazy(cls, loader, shape, nnz, n_facts, lambda_=1., meta=None):
+        """Faust whose factors are only materialized by loader() when they
+        are first used, shape, nnz and the number of factors being known
+        beforehand (see faust_io.load_faust)."""
+        F = cls._derived(None, lambda_)
+        F._loader = loader
+        F._shape = tuple(shape)
+        F._nnz = nnz
+        F._n_facts = n_facts
+        F.meta = EasyDict(meta or {})
+        return F
+
+    @property
+    def facts(self):
+        if self._loader is not None:
+            self._facts, self._loader = self._loader(), None
+        return self._facts
+
+    @property
+    def loaded(self):
+        """False while the factors of a lazy Faust have not been used."""
+        return self._loader is None
+
+    @property
+    def shape(self):
+        if self._shape is not None:
+            return self._shape
+        return self.facts[0].size(0), self.facts[-1].size(1)
+
+    def size(self, dim=None):
+        if dim is None:
+            return torch.Size(self.shape)
+        return self.shape[dim]
+
+    @property
+    def dtype(self):
+        return self.facts[0].dtype
+
+    @property
+    def device(self):
+        return self.facts[0].device
+
+    def __len__(self):
+        if self._n_facts is not None:
+            return self._n_facts
+        return len(self.facts)
+
+    def __repr__(self):
+        m, n = self.shape
+        return f'Faust({m}x{n}, n_facts={len(self)}, nnz={self.nnz()}, rcg={self.rcg():.3g})'
+
+    def nnz(self):
+        """Total number of non-zero entries of the factors."""
+        if self._nnz is not None:
+            return self._nnz
+        return nnzero_count(self.facts)
+
+    def rcg(self):
+        """Relative Complexity Gain: entries of the dense matrix over nnz()."""
+        m, n = self.shape
+        return m * n / max(self.nnz(), 1)
+
+    def density(self):
+        return 1 / self.rcg()
+
+    def transpose(self):
+        """Transposed operator (a view: the factors are not copied)."""
+        return self._derived([transpose(fact) for fact in reversed(self.facts)], self.lambda_)
+
+    def adjoint(self):
+        """Conjugate transposed operator."""
+        if not (self.dtype.is_complex or isinstance(self.lambda_, complex)):
+            return self.transpose()
+        facts = [adjoint(fact) for fact in reversed(self.facts)]
+        lambda_ = self.lambda_.conjugate() if isinstance(self.lambda_, complex) else self.lambda_
+        return self._derived(facts, lambda_)
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    @property
+    def H(self):
+        return self.adjoint()
+
+    def todense(self):
+        """Developed matrix lambda_*facts{1}*...*facts{n}."""
+        return self.lambda_ * dvp(self.facts, self.device)
+
+    def __matmul__(self, x):
+        if isinstance(x, Faust):
+            return self._derived(self.facts + x.facts, self.lambda_ * x.lambda_)
+        if x.ndim == 1:
+            return self._apply(x.unsqueeze(1)).squeeze(1)
+        if x.ndim == 2:
+            return self._apply(x)
+        # Batch of matrices (..., n, b): the batch is folded into the columns
+        batch, (n, b) = x.shape[:-2], x.shape[-2:]
+        x2 = x.reshape(-1, n, b).permute(1, 0, 2).reshape(n, -1)
+        y2 = self._apply(x2)
+        m = y2.size(0)
+        return y2.reshape(m, -1, b).permute(1, 0, 2).reshape(*batch, m, b)
+
+    def __rmatmul__(self, x):
+        if x.ndim == 1:
+            return self.transpose() @ x
+        return (self.transpose() @ x.transpose(-2, -1)).transpose(-2, -1)
+
+    def __mul__(self, alpha):
+        return self._derived(self.facts, self.lambda_ * alpha)
+
+    __rmul__ = __mul__
+
+    @staticmethod
+    def _derived(facts, lambda_):
+        F = Faust.__new__(Faust)
+        F._facts = facts
+        F._loader = None
+        F._shape = None
+        F._nnz = None
+        F._n_facts = None
+        F.lambda_ = lambda_
+        F._dense = None
+        F.meta = EasyDict()
+        return F
+
+    def _apply(self, x):
+        """Product F*x for a matrix x, in the cheapest of the orders below.
+
+        Factorized: the chain facts{1}*...*facts{n}*x is multiplied in the
+        order of minimal cost for the b columns of x (see
+        utils.chain_order.chain_plan). Developed: x is multiplied by the
+        developed matrix, which is cached at its first use. The scalar is
+        applied on the smaller of x and the result.
+        """
+        m, n = self.shape
+        b = x.size(1)
+        chain = self.facts + [x]
+        cost_facts, _ = chain_plan(chain_signature(chain))
+        cost_dense = b * m * n
+        if self._dense is None and len(self.facts) > 1:
+            cost_dense += chain_plan(chain_signature(self.facts))[0]
+        scale_input = n <= m
+        if scale_input:
+            chain[-1] = self.lambda_ * x
+        if cost_dense < cost_facts:
+            if self._dense is None:
+                self._dense = dvp(self.facts, self.device)
+            y = self._dense @ chain[-1]
+        else:
+            y = chain_prod(chain)
+        if not scale_input:
+            y = self.lambda_ * y
+        return y
@@ -0,0 +1,110 @@
+import torch
+
+from faust import Faust
+from utils.sparse import density, to_dense
+
+
+FORMAT = 'faust'
+VERSION = 1
+
+# Storage types without sparse kernels on CPU, loaded in float32 by default
+HALF_DTYPES = (torch.float16, torch.bfloat16)
+
+
+def _pack(fact, values_dtype, threshold):
+    """Factor as a dict of plain tensors: CSR arrays with int32 indices if its
+    density is lower than threshold, the dense matrix otherwise."""
+    fact = to_dense(fact).detach().cpu()
+    dtype = fact.dtype if values_dtype is None else values_dtype
+    if density(fact) >= threshold:
+        return {'kind': 'dense', 'values': fact.to(dtype).contiguous()}
+    csr = fact.to_sparse_csr()
+    return {
+        'kind': 'csr',
+        'shape': list(fact.shape),
+        'crow_indices': csr.crow_indices().to(torch.int32),
+        'col_indices': csr.col_indices().to(torch.int32),
+        'values': csr.values().to(dtype),
+    }
+
+
+def _unpack(packed, dtype):
+    values = packed['values']
+    if dtype is None and values.dtype in HALF_DTYPES:
+        dtype = torch.float32
+    if dtype is not None and values.dtype != dtype:
+        values = values.to(dtype)
+    if packed['kind'] == 'dense':
+        return values
+    return torch.sparse_csr_tensor(
+        packed['crow_indices'], packed['col_indices'], values, packed['shape'])
+
+
+def save_faust(path, F, cons=None, errors=None, values_dtype=None, dense_threshold=0.5):
+    """Saves a factorized operator in a compact file.
+
+    save_faust(path, F) saves the Faust F (or a pair (lambda, facts)) into
+    path. Factors whose density is lower than dense_threshold are stored in
+    CSR form (int32 indices and values), the others as dense matrices.
+
+    'cons' - Constraints of the factorization, saved as metadata.
+
+    'errors' - Error history (e.g. the errors of hierarchical), saved as
+        metadata.
+
+    'values_dtype' - Storage type of the values, e.g. torch.float32 or
+        torch.float16. The default value is the type of the factors.
+    """
+    if not isinstance(F, Faust):
+        lambda_, facts = F
+        F = Faust(facts, lambda_)
+    state = {
+        'format': FORMAT,
+        'version': VERSION,
+        'shape': list(F.shape),
+        'nnz': F.nnz(),
+        'lambda_': F.lambda_,
+        'cons': cons,
+        'errors': None if errors is None else errors.detach().cpu(),
+        'facts': [_pack(fact, values_dtype, dense_threshold) for fact in F.facts],
+    }
+    torch.save(state, path)
+
+
+def load_faust(path, mmap=True, lazy=True, dtype=None):
+    """Loads a factorized operator saved by save_faust.
+
+    F = load_faust(path) returns the Faust saved in path, its constraints
+    and errors being in F.meta.cons and F.meta.errors.
+
+    'mmap' - If True, the file is memory-mapped instead of read: the pages
+        of a factor are only read from disk when it is used. The default
+        value is True.
+
+    'lazy' - If True, the factors are only built at the first use of the
+        operator, only the metadata is read at loading. The default value is
+        True.
+
+    'dtype' - Type of the values of the loaded factors (e.g. to compute in
+        torch.float32 from values stored in torch.float16). The default
+        value is the storage type, except for values stored in float16 or
+        bfloat16, which are loaded in float32 (the sparse products do not
+        support them on CPU).
+    """
+    state = torch.load(path, map_location='cpu', mmap=mmap, weights_only=True)
+    if state.get('format') != FORMAT:
+        raise Exception(f'{path} is not a Faust file')
+    if state['version'] > VERSION:
+        raise Exception(f'Unsupported version of the Faust format: {state["version"]}')
+
+    packed = state['facts']
+
+    def loader():
+        return [_unpack(fact, dtype) for fact in packed]
+
+    meta = {'cons': state['cons'], 'errors': state['errors']}
+    if lazy:
+        return Faust.lazy(loader, state['shape'], state['nnz'], len(packed), state['lambda_'], meta)
+    F = Faust(loader(), state['lambda_'])
+    F.meta.update(meta)
+    return F
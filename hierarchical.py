@@ -1,9 +1,63 @@
+import time
 import torch
 
+from concurrent.futures import ThreadPoolExecutor
 from easydict import EasyDict
 from palm4msa import palm4msa
-from utils import dvp, nnzero_count
-from utils.general import check_device, check_dtype
+from proxs import Projection
+from utils import nnzero_count
+from utils.blocked import BlockedData
+from utils.checkpoint import load_checkpoint, save_checkpoint
+from utils.lambda_comp import inner
+from utils.sketch import Sketch
+from utils.sparse import to_dense
+from utils.trace import Tracer
+from utils.general import check_device, check_dtype, check_precision
+
+
+def _split_init(method, Res, cons, update_way, fact_side, dtype, device):
+    """Initial factors and lambda of the 2-factorisation of Res.
+
+    'zeros' - Zero factor and identity, in the order given by update_way.
+    'svd' - Factors U*sqrt(S) and sqrt(S)*V' of a randomized truncated SVD
+        of Res (see utils.sketch.Sketch), projected onto their constraints,
+        with the lambda fitting their product to Res.
+    'previous' - Res itself as the factor which is factorized further and
+        the identity as the other one, i.e. a warm start from the factor of
+        the previous level. Falls back to 'zeros' if the sizes do not allow
+        it or if Res is a BlockedData, which is not loaded as a factor.
+    """
+    m, p, n = cons[0][2], cons[0][3], cons[1][3]
+    if method == 'previous' and not isinstance(Res, BlockedData) \
+            and tuple(Res.shape) == ((m, p) if fact_side else (p, n)):
+        Res = to_dense(Res).to(device=device, dtype=dtype)
+        if fact_side:
+            return [Res.clone(), torch.eye(p, n, device=device, dtype=dtype)], 1
+        return [torch.eye(m, p, device=device, dtype=dtype), Res.clone()], 1
+    if method == 'svd':
+        if not isinstance(Res, BlockedData):
+            Res = to_dense(Res).to(device=device, dtype=dtype)
+        r = min(m, p, n)
+        sketch = Sketch(Res, r)
+        U, S, Vh = torch.linalg.svd(sketch.B, full_matrices=False)
+        S = S[:r].sqrt().to(dtype)
+        left = torch.zeros(m, p, device=device, dtype=dtype)
+        right = torch.zeros(p, n, device=device, dtype=dtype)
+        left[:, :r] = (sketch.Q @ U[:, :r]) * S
+        right[:r] = S[:, None] * Vh[:r]
+        left = Projection(cons[0], device)(left)
+        right = Projection(cons[1], device)(right)
+        D = left @ right
+        DD = inner(D, D)
+        if DD > 0:
+            if isinstance(Res, BlockedData):
+                XD = Res.project([left], [right]).diagonal().sum().real
+            else:
+                XD = inner(Res, D)
+            return [left, right], float(XD / DD)
+    if update_way:
+        return [torch.eye(m, p, device=device, dtype=dtype), torch.zeros(p, n, device=device, dtype=dtype)], 1
+    return [torch.zeros(m, p, device=device, dtype=dtype), torch.eye(p, n, device=device, dtype=dtype)], 1
 
 
 def hierarchical(params):
@@ -19,7 +73,9 @@ def hierarchical(params):
   --------------------------
 
     'data' - Training data.
-      A matrix to hierarchically factorize.
+      A matrix to hierarchically factorize, or a utils.blocked.BlockedData
+      (e.g. BlockedData('X.npy', block_rows)) for a matrix kept on disk,
+      which is then never loaded as a whole.
 
     'nfacts' - Number of factors.
       Specifies the desired number of factors.
@@ -57,6 +113,78 @@ def hierarchical(params):
       the factors are updated from left to right. The default value is 0.
 
     'device' - Running device ('cuda' or 'cpu')
+
+    'sparse_threshold', 'sparse_format' - Sparse storage of the factors,
+      see palm4msa. The default value of sparse_threshold is 0 (dense).
+
+    'tol_obj', 'tol_err', 'support_stable' - Stopping criteria of both the
+      2-factorisations and the global optimisations, see palm4msa. All are
+      disabled (0) by default.
+
+    'max_time' - Wall-clock budget in seconds of the whole factorization,
+      shared by the successive PALM runs. Disabled (0) by default.
+
+    'return_info' - If True, hierarchical returns lambda, facts, errors, info
+      where info.levels holds, for each level, the PALM info of the
+      2-factorisation ('split') and of the global optimisation ('glob'):
+      number of iterations and reason of the stop. The default value is
+      False.
+
+    'precision' - Precision policy of the PALM runs ('double', 'single' or
+      'bfloat16'), see palm4msa. The default value is 'double'.
+
+    'lipschitz', 'power_iter', 'lipschitz_margin', 'exact_every' - Estimator
+      of the Lipschitz moduli of the PALM runs ('exact' or 'power') and its
+      settings, see palm4msa. The default value of lipschitz is 'exact'.
+
+    'checkpoint' - Directory where the state of the factorization is saved
+      (state.pt) after each stage of each level, so that an interrupted run
+      can be resumed. The state at the beginning of the global optimisation
+      of each level k is also kept (level_k.pt). Disabled (None) by default.
+
+    'checkpoint_every' - If > 0, the state is also saved every
+      checkpoint_every PALM iterations within a stage. The default value is
+      0.
+
+    'resume' - If True and the checkpoint exists, the factorization resumes
+      at the level, stage and PALM iteration where it was saved. The
+      default value is False.
+
+    'resume_level' - If set, the factorization restarts from the global
+      optimisation of level resume_level, as saved in level_k.pt (e.g. with
+      a different n_iter2), without redoing the previous levels.
+
+    'sketch_rank', 'sketch_oversample', 'sketch_power' - If sketch_rank > 0,
+      a randomized sketch of the data is computed once (see palm4msa) and
+      the PALM runs on the data (the first 2-factorisation and the global
+      optimisations) iterate on it. The default value is 0 (no sketch).
+
+    'compile_proxs', 'compile_cache' - Compilation of the projections of
+      the PALM runs, see palm4msa. Disabled by default.
+
+    'tracer', 'callback', 'trace_every' - Instrumentation of the PALM runs,
+      see palm4msa. The events are tagged with the level and the stage
+      ('split' or 'glob') and each stage is recorded as a span. Disabled by
+      default.
+
+    'sketch_refine' - Number of iterations on the full data at the end of
+      each global optimisation, after its n_iter2 sketched ones. The
+      default value is 0.
+
+    'split_init' - Initialization of the 2-factorisations: 'zeros' (a zero
+      factor and the identity), 'svd' (factors of a randomized truncated SVD
+      of the residual, projected onto their constraints) or 'previous' (the
+      residual itself and the identity, i.e. a warm start from the factor of
+      the previous level, if the sizes allow it). A list of them runs one
+      2-factorisation per initialization, concurrently on a pool of
+      'n_threads' threads (default: one per initialization), and keeps the
+      one with the lowest relative error. The default value is 'zeros'.
+
+    'glob_reduce_tol', 'glob_reduce_iter' - If glob_reduce_tol > 0, the
+      global optimisation of the levels whose 2-factorisation reaches a
+      relative error of at most glob_reduce_tol runs glob_reduce_iter
+      iterations instead of niter2. The default values are 0 (disabled)
+      and niter2/4.
     """
     # Setting parameters values
     n_iter1 = params.get('n_iter1', 500)
@@ -65,7 +193,41 @@ def hierarchical(params):
     update_way = params.get('update_way', 0)
     fact_side = params.get('fact_side', 0)
     device = params.get('device', 'cpu')
-    dtype = torch.float64
+    sparse_threshold = params.get('sparse_threshold', 0)
+    sparse_format = params.get('sparse_format', 'csr')
+    max_time = params.get('max_time', 0)
+    return_info = params.get('return_info', False)
+    checkpoint = params.get('checkpoint', None)
+    checkpoint_every = params.get('checkpoint_every', 0)
+    resume = params.get('resume', False)
+    resume_level = params.get('resume_level', None)
+    tracer = params.get('tracer', None)
+    if tracer is None:
+        callback = params.get('callback', None)
+        tracer = Tracer(params.get('trace_every', 1) if callback is not None else 0, callback)
+    precision = params.get('precision', 'double')
+    palm_params = dict(
+        tracer=tracer,
+        precision=precision,
+        lipschitz=params.get('lipschitz', 'exact'),
+        power_iter=params.get('power_iter', 2),
+        lipschitz_margin=params.get('lipschitz_margin', 1.05),
+        exact_every=params.get('exact_every', 0),
+        tol_obj=params.get('tol_obj', 0),
+        tol_err=params.get('tol_err', 0),
+        support_stable=params.get('support_stable', 0),
+        compile_proxs=params.get('compile_proxs', False),
+        compile_cache=params.get('compile_cache', None),
+    )
+    dtype, _ = check_precision(precision, params.data.dtype.is_complex)
+    sketch_rank = params.get('sketch_rank', 0)
+    sketch_refine = params.get('sketch_refine', 0)
+    split_init = params.get('split_init', 'zeros')
+    if isinstance(split_init, str):
+        split_init = [split_init]
+    n_threads = params.get('n_threads', 0)
+    glob_reduce_tol = params.get('glob_reduce_tol', 0)
+    glob_reduce_iter = params.get('glob_reduce_iter', n_iter2 // 4)
 
     # Verify the validity of the constraints
     verif_size = params.data.size(0) == params.cons[0][0][2] and params.cons[0][0][3] \
@@ -88,67 +250,149 @@ def hierarchical(params):
     # Initialization
     lambda_ = 1
     facts = [[]] * params.n_facts
-    params.data = check_device(params.data, device)
-    params.data = check_dtype(params.data, dtype)
-    Res = params.data
-    errors = torch.zeros(params.n_facts-1, 2, device=device)
+    if isinstance(params.data, BlockedData):
+        params.data = params.data.to(dtype, device)
+    else:
+        params.data = check_device(params.data, device)
+        params.data = check_dtype(params.data, dtype)
+    errors = torch.zeros(params.n_facts-1, 2, dtype=torch.float64, device=device)
+    sketch = None
+    if sketch_rank > 0:
+        sketch = Sketch(params.data, sketch_rank, params.get('sketch_oversample', 10), params.get('sketch_power', 1))
+    levels = []
+    start = time.perf_counter()
+
+    def remaining_time():
+        if not max_time:
+            return 0
+        # A tiny budget still lets PALM run one iteration
+        return max(max_time - (time.perf_counter() - start), 1e-9)
+
+    # Resuming from a checkpoint: level, stage ('split' or 'glob') and state
+    # of the PALM run in progress (None if it has not started)
+    k_start, stage, palm_state = 0, 'split', None
+    if checkpoint is not None and (resume or resume_level is not None):
+        state = load_checkpoint(checkpoint, params, resume_level)
+        if state is not None:
+            k_start, stage, palm_state = state.k, state.stage, state.palm
+            lambda_, facts, errors, levels = state.lambda_, state.facts, state.errors.to(device), state.levels
+
+    def save(k, stage, palm=None, level=False):
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, params, k, stage, lambda_, facts, errors, levels, palm, level)
+
+    def palm_checkpoint_fn(k, stage):
+        if checkpoint is None or not checkpoint_every:
+            return None
+        return lambda n, lambda_palm, facts_palm: save(
+            k, stage, EasyDict(iter=n, lambda_=lambda_palm, facts=facts_palm))
 
-    for k in range(0, params.n_facts-1):
+    for k in range(k_start, params.n_facts-1):
         cons = [params.cons[0][k], params.cons[1][k]]
+        info2 = None
 
         # Factorization in 2
-        init_facts = [
-            torch.zeros(cons[0][2], cons[0][3], device=device),
-            torch.eye(cons[1][2], cons[1][3], device=device)
-        ]
-        if update_way:
-            init_facts = [
-                torch.eye(cons[0][2], cons[0][3], device=device),
-                torch.zeros(cons[1][2], cons[1][3], device=device)
-            ]
-        params2 = EasyDict(
-            n_iter=n_iter1,
-            n_facts=2,
-            data=Res,
-            verbose=verbose,
-            update_way=update_way,
-            cons=[cons[0], cons[1]],
-            init_facts=init_facts,
-            init_lambda=1,
-            device=device,
-        )
-        lambda2, facts2 = palm4msa(params2)
+        if stage == 'split':
+            if k == 0:
+                Res = params.data
+            elif fact_side:
+                Res = facts[0]
+            else:
+                Res = facts[k]
+            if palm_state is not None:
+                inits = [(palm_state.facts, palm_state.lambda_, palm_state.iter)]
+            else:
+                inits = [
+                    _split_init(method, Res, cons, update_way, fact_side, dtype, device) + (0,)
+                    for method in split_init
+                ]
+
+            def run_split(c):
+                init_facts, init_lambda, start_iter = inits[c]
+                params2 = EasyDict(
+                    n_iter=n_iter1,
+                    n_facts=2,
+                    data=Res,
+                    verbose=verbose,
+                    update_way=update_way,
+                    cons=[cons[0], cons[1]],
+                    init_facts=list(init_facts),
+                    init_lambda=init_lambda,
+                    device=device,
+                    sparse_threshold=sparse_threshold,
+                    sparse_format=sparse_format,
+                    max_time=remaining_time(),
+                    start_iter=start_iter,
+                    checkpoint_fn=palm_checkpoint_fn(k, 'split') if len(inits) == 1 else None,
+                    checkpoint_every=checkpoint_every,
+                    return_info=True,
+                    sketch=sketch if k == 0 else None,
+                    **palm_params,
+                )
+                # Only the first candidate is traced
+                if c > 0:
+                    params2.tracer = None
+                return palm4msa(params2)
+
+            with tracer.span(f'level {k} split', level=k, stage='split'):
+                if len(inits) == 1:
+                    results = [run_split(0)]
+                else:
+                    with ThreadPoolExecutor(n_threads or len(inits)) as pool:
+                        results = list(pool.map(run_split, range(len(inits))))
+            lambda2, facts2, info2 = min(results, key=lambda result: result[2].rel_error)
+
+            if fact_side:
+                facts[2:] = facts[1:-1]
+                facts[:2] = facts2
+            else:
+                facts[k:k+2] = facts2
+            lambda_ = lambda_ * lambda2
+            palm_state = None
+            save(k, 'glob', level=True)
 
-        if fact_side:
-            facts[2:] = facts[1:-1]
-            facts[:2] = facts2
-        else:
-            facts[k:k+2] = facts2
-        lambda_ = lambda_ * lambda2
-        
         # Global optimization
         if fact_side:
             params3_cons = [cons[0]] + params.cons[1][k::-1]
         else:
             params3_cons = params.cons[0][:k+1] + [cons[1]]
+        init_facts, init_lambda, start_iter = facts[:k+2], lambda_, 0
+        n_iter_glob = n_iter2
+        if glob_reduce_tol and info2 is not None and info2.rel_error <= glob_reduce_tol:
+            n_iter_glob = glob_reduce_iter
+        if palm_state is not None:
+            init_facts, init_lambda, start_iter = palm_state.facts, palm_state.lambda_, palm_state.iter
         params3 = EasyDict(
-            n_iter=n_iter2,
+            n_iter=n_iter_glob,
             n_facts=k+2,
             data=params.data,
             verbose=verbose,
             update_way=update_way,
             cons=params3_cons,
-            init_facts=facts[:k+2],
-            init_lambda=lambda_,
+            init_facts=init_facts,
+            init_lambda=init_lambda,
             device=device,
+            sparse_threshold=sparse_threshold,
+            sparse_format=sparse_format,
+            max_time=remaining_time(),
+            start_iter=start_iter,
+            checkpoint_fn=palm_checkpoint_fn(k, 'glob'),
+            checkpoint_every=checkpoint_every,
+            return_info=True,
+            sketch=sketch,
+            sketch_refine=sketch_refine,
+            **palm_params,
         )
-        lambda_, facts3 = palm4msa(params3)
+        with tracer.span(f'level {k} glob', level=k, stage='glob'):
+            lambda_, facts3, info3 = palm4msa(params3)
         facts[:k+2] = facts3
-        if fact_side:
-            Res = facts3[0]
-        else:
-            Res = facts3[k+1]
 
-        errors[k, 0] = torch.linalg.norm(params.data - lambda_ * dvp(facts3, device)) / torch.linalg.norm(params.data)
+        errors[k, 0] = info3.rel_error
         errors[k, 1] = nnzero_count(facts3) / params.data.numel()
-    return lambda_, facts, errors
\ No newline at end of file
+        levels.append(EasyDict(split=info2, glob=info3))
+        stage, palm_state = 'split', None
+        save(k+1, 'split')
+
+    if return_info:
+        return lambda_, facts, errors, EasyDict(levels=levels)
+    return lambda_, facts, errors
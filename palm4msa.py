@@ -1,9 +1,18 @@
-import math
+import contextlib
 import torch
 
-from proxs import prox_sp, prox_normcol, prox_sp_pos, prox_spcol, prox_splin
-from utils import mult_right, dvp, grad_comp, grad_comp_cpx
-from utils.general import check_device, check_dtype
+from proxs import Projection, enable_compile_cache
+from easydict import EasyDict
+from utils import grad_comp, lambda_comp, error_comp, ChainCache
+from utils.lipschitz import ExactLipschitz, PowerLipschitz
+from utils.blocked import BlockedData
+from utils.lambda_comp import inner
+from utils.sketch import Sketch, grad_comp_sketch, lambda_comp_sketch
+from utils.support import Support, constraint_support
+from utils.trace import Tracer
+from utils.sparse import sparsify, to_dense
+from utils.stopping import StoppingCriterion
+from utils.general import check_device, check_dtype, check_precision
 
 
 def palm4msa(params):
@@ -16,7 +25,9 @@ def palm4msa(params):
     --------------------------
 
     'data' - Training data.
-        A matrix containing the training signals as its columns.
+        A matrix containing the training signals as its columns, or a
+        utils.blocked.BlockedData for data kept on disk: the products
+        involving it are then streamed by blocks of rows.
 
     'nfacts' - Number of factors.
         Specifies the desired number of factors.
@@ -28,6 +39,13 @@ def palm4msa(params):
         should be itself a cell-array of size 1*4 taking this form for a
         factor of size m*n:
         {'constraint name', 'constraint parameter', m, n}
+        Besides 'sp', 'spcol', 'splin', 'normcol', 'sppos' and 'const',
+        the structured constraints 'blockdiag' (parameter: number of
+        diagonal blocks), 'butterfly' (parameter: level of the butterfly
+        factor, see utils.support.Support.butterfly) and 'supp' (parameter:
+        boolean mask of the support) fix the support of the factor; their
+        gradients and projections are only computed on the support. Other
+        types of constraints can be added with proxs.register_constraint.
 
     'niter' - Number of iterations.
         Specifies the number of iterations to run.
@@ -50,35 +68,165 @@ def palm4msa(params):
         the factors are updated from left to right. The default value is 0.
     
     'device' - Running device ('cuda' or 'cpu')
+
+    'lipschitz' - Estimator of the Lipschitz modulus of the gradients.
+        'exact' computes the spectral norms of the developed partial
+        products, 'power' runs a few warm-started power iterations per
+        factor update on the factorized products. The default value is
+        'exact'.
+
+    'power_iter' - Number of power iterations per factor update when
+        lipschitz='power'. The default value is 2.
+
+    'lipschitz_margin' - Safety factor applied to the power-iteration
+        estimate. The default value is 1.05.
+
+    'exact_every' - If > 0 and lipschitz='power', the exact Lipschitz
+        modulus is computed every exact_every iterations. The default value
+        is 0 (never).
+
+    'sparse_threshold' - Density under which a factor is stored in a
+        sparse format between its updates, so that the products involving
+        it use sparse-dense kernels. The returned factors are then sparse
+        tensors. The default value is 0 (factors are always dense).
+
+    'sparse_format' - Sparse format of the factors, 'csr' or 'coo'. The
+        default value is 'csr'.
+
+    'tol_obj', 'tol_err', 'support_stable', 'max_time' - Stopping criteria
+        evaluated after each iteration, in addition to n_iter: relative
+        change of the objective, relative error, number of iterations with
+        unchanged supports and wall-clock budget in seconds (see
+        utils.stopping.StoppingCriterion). All are disabled (0) by default.
+
+    'start_iter' - Number of iterations already run, when resuming from
+        init_facts and init_lambda saved at that iteration. The iterations
+        start_iter to n_iter-1 are run. The default value is 0.
+
+    'checkpoint_fn', 'checkpoint_every' - If checkpoint_every > 0,
+        checkpoint_fn(n, lambda, facts) is called every checkpoint_every
+        iterations, n being the number of iterations run so far. The
+        default value of checkpoint_every is 0 (never).
+
+    'precision' - Precision policy. 'double': everything in float64.
+        'single': factors, data and products in float32. 'bfloat16': factors
+        and data in float32, products of the gradient steps in bfloat16.
+        The scalar quantities (lambda update, Lipschitz moduli, errors) are
+        accumulated in float64 in all cases. The default value is 'double'.
+        For complex data, 'double' and 'single' stand for complex128 and
+        complex64 (lambda stays real).
+
+    'compile_proxs' - If True, the projections onto the constraint sets are
+        compiled with torch.compile (see proxs.Projection). The default
+        value is False.
+
+    'compile_cache' - Directory of a persistent cache of the compiled
+        kernels, reused across runs. The default value is None.
+
+    'tracer' - utils.trace.Tracer recording, every tracer.every iterations,
+        the objective, lambda, non-zeros and step sizes of the factors and
+        the time spent in the gradient, Lipschitz, projection and lambda
+        phases. The default value is None (no instrumentation).
+
+    'callback', 'trace_every' - Shortcut for tracer=Tracer(trace_every,
+        callback): callback(event) is called every trace_every iterations
+        with the event as a dict. The default value of trace_every is 1.
+
+    'sketch_rank' - If > 0, the n_iter iterations are run on a randomized
+        sketch Q*B of the data (see utils.sketch.Sketch) of rank
+        sketch_rank: the gradients and lambda are computed from the
+        products L'*Q and B*R', so that no m*n residual is formed. The
+        errors of these iterations combine the exact ||X||^2 with the
+        sketched <Q*B, D>: they estimate the error on the data, not the
+        error with respect to the sketch. The default value is 0 (no
+        sketch).
+
+    'sketch' - Precomputed Sketch of the data, used instead of sketch_rank
+        (e.g. to share it between several runs on the same data).
+
+    'sketch_oversample', 'sketch_power' - Oversampling and number of power
+        iterations of the sketch. The default values are 10 and 1.
+
+    'sketch_refine' - Number of iterations run on the full data after the
+        sketched ones. If a stopping criterion (other than max_time) is met
+        during the sketched iterations, the refinement starts. The default
+        value is 0.
+
+    'freeze_stable', 'freeze_iter' - Support-frozen phase. Once the supports
+        of the factors have not changed during freeze_stable consecutive
+        iterations, or from iteration freeze_iter, the supports of the
+        factors whose constraint allows it (see proxs.register_constraint:
+        'sp', 'spcol', 'splin', 'sppos' and the structured constraints) are
+        frozen. Only the values of these factors are then updated: their
+        gradient is only computed on the support (sampled product) and
+        their projection is a normalization of the values, without any
+        selection, the factors being stored as set by sparse_threshold.
+        Disabled (0 and None) by default.
+
+    'return_info' - If True, palm4msa returns lambda, facts, info where info
+        holds the relative error 'rel_error' of the last iteration, the
+        number of iterations run 'n_iter' and the reason of the stop
+        'stop_reason' ('n_iter' or one of the stopping criteria). The
+        default value is False.
     """
     # Setting optional parameters values
     init_lambda = params.get('init_lambda', 1)
     verbose = params.get('verbose', 0)
     update_way = params.get('update_way', 0)
     device = params.get('device', 'cpu')
-    dtype = torch.float64
+    lipschitz = params.get('lipschitz', 'exact')
+    power_iter = params.get('power_iter', 2)
+    lipschitz_margin = params.get('lipschitz_margin', 1.05)
+    exact_every = params.get('exact_every', 0)
+    sparse_threshold = params.get('sparse_threshold', 0)
+    sparse_format = params.get('sparse_format', 'csr')
+    return_info = params.get('return_info', False)
+    start_iter = params.get('start_iter', 0)
+    checkpoint_fn = params.get('checkpoint_fn', None)
+    checkpoint_every = params.get('checkpoint_every', 0)
+    stop = StoppingCriterion(
+        tol_obj=params.get('tol_obj', 0),
+        tol_err=params.get('tol_err', 0),
+        support_stable=params.get('support_stable', 0),
+        max_time=params.get('max_time', 0),
+    )
+    precision = params.get('precision', 'double')
+    dtype, prod_dtype = check_precision(precision, params.data.dtype.is_complex)
+    sketch = params.get('sketch', None)
+    sketch_rank = params.get('sketch_rank', 0)
+    sketch_refine = params.get('sketch_refine', 0)
+    freeze_iter = params.get('freeze_iter', None)
+    freeze_detect = StoppingCriterion(support_stable=params.get('freeze_stable', 0))
+    if prod_dtype is None:
+        prod_context = contextlib.nullcontext
+    else:
+        prod_context = lambda: torch.autocast(torch.device(device).type, dtype=prod_dtype)
 
     if params.n_facts != len(params.init_facts):
         raise Exception('Wrong initialization: params.nfacts and params.init_facts are in conflict')
     
-    handles_cell = [lambda x: x] * params.n_facts
-    for i in range(params.n_facts):
-        cons = params.cons[i]
-        if cons[0] == 'sp':
-            handles_cell[i] = lambda x: prox_sp(x, cons[1])
-        elif cons[0] == 'spcol':
-            handles_cell[i] = lambda x: prox_spcol(x, cons[1])
-        elif cons[0] == 'splin':
-            handles_cell[i] = lambda x: prox_splin(x, cons[1])
-        elif cons[0] == 'normcol':
-            handles_cell[i] = lambda x: prox_normcol(x, cons[1])
-        elif cons[0] == 'const':
-            handles_cell[i] = lambda x: cons[1]
-        elif cons[0] == 'sppos':
-            handles_cell[i] = lambda x: prox_sp_pos(x, cons[1])
-        else:
-            raise Exception('The expressed type of constraint is not known')
+    # Projection of each factor, bound once to its own constraint
+    if params.get('compile_cache', None) is not None:
+        enable_compile_cache(params.compile_cache)
+    compile_proxs = params.get('compile_proxs', False)
+    tracer = params.get('tracer', None)
+    if tracer is None:
+        callback = params.get('callback', None)
+        tracer = Tracer(params.get('trace_every', 1) if callback is not None else 0, callback)
+    handles_cell = [Projection(params.cons[i], device, compile_proxs) for i in range(params.n_facts)]
+    supports = [constraint_support(params.cons[i]) for i in range(params.n_facts)]
+    supports = [None if support is None else support.to(device) for support in supports]
     
+    if lipschitz == 'exact':
+        lipschitz_cell = [ExactLipschitz(device) for _ in range(params.n_facts)]
+    elif lipschitz == 'power':
+        lipschitz_cell = [
+            PowerLipschitz(power_iter, margin=lipschitz_margin, exact_every=exact_every, device=device)
+            for _ in range(params.n_facts)
+        ]
+    else:
+        raise Exception('The expressed type of Lipschitz estimator is not known')
+
     # Initialization
     lambda_ = init_lambda
     facts = params.init_facts
@@ -86,42 +234,140 @@ def palm4msa(params):
         if not torch.is_tensor(fact):
             fact = torch.tensor(fact, dtype=dtype, device=device)
         else:
-            fact = check_device(fact, device)
+            fact = check_device(to_dense(fact), device)
             fact = check_dtype(fact, dtype)
-        facts[i] = fact
+        # Factors are projected in place, the caller's tensors are kept
+        facts[i] = sparsify(fact.clone(), sparse_threshold, sparse_format)
     
-    params.data = check_device(params.data, device)
-    params.data = check_dtype(params.data, dtype)
-    X = params.data
+    # Out-of-core data is only accessed through block-streamed products
+    blocked = None
+    if isinstance(params.data, BlockedData):
+        params.data = blocked = params.data.to(dtype, device)
+        X = params.data
+        X_norm2 = X.norm2
+    else:
+        params.data = check_device(to_dense(params.data), device)
+        params.data = check_dtype(params.data, dtype)
+        X = params.data
+        X_norm2 = inner(X, X)
+    if sketch is None and sketch_rank > 0:
+        sketch = Sketch(X, sketch_rank, params.get('sketch_oversample', 10), params.get('sketch_power', 1))
+    if sketch is None:
+        sketch_refine = 0
+    else:
+        sketch = sketch.to(dtype, device)
+    n_total = params.n_iter + sketch_refine
     if update_way:
-        maj = reversed(range(params.n_facts))
+        maj = list(reversed(range(params.n_facts)))
     else:
-        maj = range(params.n_facts)
+        maj = list(range(params.n_facts))
     
-    for i in range(params.n_iter):
+    # Factors whose support can be frozen, and their frozen supports
+    freezable = [j for j in range(params.n_facts) if handles_cell[j].on_support is not None]
+    frozen = [None] * params.n_facts
+
+    # Partial products of the factors, updated along the sweep
+    chain = ChainCache(facts, update_way, sparse_threshold)
+    n_iter, stop_reason = start_iter, 'n_iter'
+    sketch_stopped = False
+    for i in range(start_iter, n_total):
+        sketched = sketch is not None and i < params.n_iter
+        if sketched and sketch_stopped:
+            continue
+        if freezable and frozen[freezable[0]] is None and (
+                freeze_iter is not None and i >= freeze_iter
+                or freeze_detect and freeze_detect(0, [facts[j] for j in freezable])):
+            for j in freezable:
+                frozen[j] = Support(to_dense(facts[j]) != 0).to(device)
+        # Operator giving L'*X*R' (sketch or streamed data), None for in-memory data
+        proj = sketch if sketched else blocked
+        tracer.begin_iter(i)
+        steps = [None] * params.n_facts
+        chain.begin_sweep()
         for j in maj:
-            if params.cons[j] == 'const':
+            if handles_cell[j].is_const:
                 facts[j] = handles_cell[j](facts[j])
+            elif frozen[j] is not None:
+                # Values-only update on the frozen support
+                L = chain.left(j)
+                R = chain.right(j)
+                S = to_dense(facts[j])
+                support = frozen[j]
+                with prod_context(), tracer.phase('grad', j):
+                    lipschitz_j = tracer.timed('lipschitz', lipschitz_cell[j], j)
+                    if proj is not None:
+                        grad, LC = grad_comp_sketch(L, S, R, proj, lambda_, device, lipschitz_j)
+                        grad = support.values(grad)
+                    else:
+                        grad, LC = grad_comp(L, S, R, X, lambda_, device, lipschitz_j, support, values=True)
+                c = LC * 1.001
+                steps[j] = 1/c
+                with tracer.phase('prox', j):
+                    values = handles_cell[j].on_support(support.values(S) - (1/c)*grad)
+                    facts[j] = sparsify(support.scatter(values, out=S), sparse_threshold, sparse_format)
             else:
-                L = facts[:j]
-                R = facts[j+1:]
-                if torch.isreal(X).all():
-                    grad, LC = grad_comp(L, facts[j], R, params.data, lambda_, device)
-                else:
-                    grad, LC = grad_comp_cpx(L, facts[j], R, params, lambda_, device)
+                L = chain.left(j)
+                R = chain.right(j)
+                S = to_dense(facts[j])
+                with prod_context(), tracer.phase('grad', j):
+                    lipschitz_j = tracer.timed('lipschitz', lipschitz_cell[j], j)
+                    if proj is not None:
+                        grad, LC = grad_comp_sketch(L, S, R, proj, lambda_, device, lipschitz_j)
+                    else:
+                        grad, LC = grad_comp(L, S, R, X, lambda_, device, lipschitz_j, supports[j])
 
                 c = LC * 1.001
+                steps[j] = 1/c
                 cons = params.cons[j]
                 if cons[0] == 'l0pen':
                     pass
                 elif cons[0] == 'l1pen':
                     pass
                 else:
-                    facts[j] = handles_cell[j](facts[j] - (1/c)*grad)
+                    with tracer.phase('prox', j):
+                        facts[j] = handles_cell[j](S - (1/c)*grad, out=S)
+                        facts[j] = sparsify(facts[j], sparse_threshold, sparse_format)
+            chain.update(j)
         
-        lambda_ = torch.trace(mult_right(X.T, facts)) / torch.trace(mult_right(dvp(facts, device).T, facts))
+        # Scalar update and error from the cached partial products
+        with tracer.phase('lambda'):
+            if proj is not None:
+                lambda_, XD, DD = lambda_comp_sketch(*chain.last(), proj)
+            else:
+                lambda_, XD, DD = lambda_comp(*chain.last(), X)
+        if tracer.sampling:
+            objective = error_comp(lambda_, XD, DD, X_norm2)
+            tracer.end_iter(lambda_, objective, torch.sqrt(objective / X_norm2), facts, steps)
+
+        n_iter = i + 1
+        if checkpoint_every > 0 and n_iter % checkpoint_every == 0 and n_iter < n_total:
+            checkpoint_fn(n_iter, lambda_, facts)
 
         if verbose:
-            rmse = torch.linalg.norm(X - lambda_*dvp(facts, device), 'fro') / math.sqrt(X.numel())
+            rmse = torch.sqrt(error_comp(lambda_, XD, DD, X_norm2) / X.numel())
             print(f'Iter {i}, RMSE={rmse}')
-    return lambda_, facts
\ No newline at end of file
+
+        if stop:
+            reason = stop(torch.sqrt(error_comp(lambda_, XD, DD, X_norm2) / X_norm2), facts)
+            if reason is not None:
+                if sketched and sketch_refine and reason != 'max_time':
+                    sketch_stopped = True
+                    continue
+                stop_reason = reason
+                break
+
+    if not return_info:
+        return lambda_, facts
+    if n_iter == start_iter:
+        if sketch is not None and start_iter < params.n_iter:
+            _, XD, DD = lambda_comp_sketch(facts[:-1], facts[-1], [], sketch)
+        elif blocked is not None:
+            _, XD, DD = lambda_comp_sketch(facts[:-1], facts[-1], [], blocked)
+        else:
+            _, XD, DD = lambda_comp(facts[:-1], facts[-1], [], X)
+    info = EasyDict(
+        rel_error=torch.sqrt(error_comp(lambda_, XD, DD, X_norm2) / X_norm2),
+        n_iter=n_iter,
+        stop_reason=stop_reason,
+    )
+    return lambda_, facts, info
\ No newline at end of file
@@ -0,0 +1,160 @@
+import torch
+
+from proxs import Projection
+from utils import ChainCache
+from utils.general import check_device, check_dtype, check_precision
+
+
+def _sq_norm2(D, v, n_iter):
+    """Squared spectral norms of the batch of matrices D.
+
+    If v is None, they are computed exactly, otherwise n_iter power
+    iterations are run from the batch of vectors v, which is updated.
+    """
+    if D is None:
+        return 1., v
+    if v is None:
+        D = D.to(torch.complex128 if D.is_complex() else torch.float64)
+        return torch.linalg.matrix_norm(D, ord=2)**2, None
+    for _ in range(n_iter):
+        v = D.mH @ (D @ v)
+        v = v / torch.linalg.vector_norm(v, dim=(-2, -1), keepdim=True).clamp(min=1e-300)
+    return ((D @ v).abs()**2).sum(dim=(-2, -1), dtype=torch.float64), v
+
+
+def _inner(A, B):
+    """Real parts of the inner products of the batches of matrices A and B,
+    accumulated in float64."""
+    if A.is_complex():
+        A = torch.view_as_real(A.resolve_conj())
+        B = torch.view_as_real(B.resolve_conj())
+        return (A * B).sum(dim=(-3, -2, -1), dtype=torch.float64)
+    return (A * B).sum(dim=(-2, -1), dtype=torch.float64)
+
+
+def palm4msa_batched(params):
+    """Factorization of a batch of data matrices into multiple factors using
+    PALM.
+
+    lambda, facts, errors = palm4msa_batched(params) runs palm4msa on each
+    matrix of the batch params.data (B*m*n) with the same constraints, as
+    batched tensor operations. The factors in "facts" are batches (B*m_j*n_j),
+    "lambda" holds the B multiplicative scalars and "errors" the B relative
+    errors || X - lambda*D || / || X ||.
+
+    Required fields in PARAMS:
+    --------------------------
+
+    'data' - Training data.
+        A B*m*n tensor of matrices to factorize.
+
+    'n_facts', 'cons', 'n_iter' - As in palm4msa. The constraints are shared
+        by the whole batch.
+
+    'init_facts' - Initialization of "facts". Each factor is either a matrix
+        shared by the batch or a batch of matrices.
+
+    Optional fields in PARAMS:
+    --------------------------
+
+    'init_lambda' - Initialization of "lambda", a scalar or B scalars. The
+        default value is 1.
+
+    'update_way', 'device' - As in palm4msa.
+
+    'lipschitz', 'power_iter', 'lipschitz_margin' - As in palm4msa (the
+        power iteration is batched).
+
+    'precision' - 'double' or 'single' type of the factors and products,
+        see palm4msa (complex128 or complex64 for complex data). The
+        scalars and errors are accumulated in float64. The default value is
+        'double'.
+    """
+    init_lambda = params.get('init_lambda', 1)
+    update_way = params.get('update_way', 0)
+    device = params.get('device', 'cpu')
+    lipschitz = params.get('lipschitz', 'exact')
+    power_iter = params.get('power_iter', 2)
+    lipschitz_margin = params.get('lipschitz_margin', 1.05)
+    precision = params.get('precision', 'double')
+    dtype, prod_dtype = check_precision(precision, params.data.dtype.is_complex)
+    if prod_dtype is not None:
+        raise Exception(f'The precision {precision} is not supported by palm4msa_batched')
+
+    if params.n_facts != len(params.init_facts):
+        raise Exception('Wrong initialization: params.nfacts and params.init_facts are in conflict')
+    if params.data.ndim != 3:
+        raise Exception(f'Data must be a batch of matrices, received a tensor of dimension {params.data.ndim}')
+    if lipschitz not in ('exact', 'power'):
+        raise Exception('The expressed type of Lipschitz estimator is not known')
+
+    X = check_dtype(check_device(params.data, device), dtype)
+    B = X.size(0)
+    X_norm2 = _inner(X, X)
+    lambda_ = torch.as_tensor(init_lambda, dtype=torch.float64, device=device).expand(B).clone()
+    facts = []
+    for fact in params.init_facts:
+        fact = check_dtype(check_device(torch.as_tensor(fact), device), dtype)
+        facts.append(fact.expand(B, *fact.shape[-2:]).clone())
+
+    # Power-iteration vectors of L and R' for each factor
+    v_L = [None] * params.n_facts
+    v_R = [None] * params.n_facts
+    if lipschitz == 'power':
+        gen = torch.Generator(device=device).manual_seed(0)
+        for j in range(params.n_facts):
+            v_L[j] = torch.randn(B, facts[j].size(1), 1, generator=gen, dtype=dtype, device=device)
+            v_R[j] = torch.randn(B, facts[j].size(2), 1, generator=gen, dtype=dtype, device=device)
+
+    # Projections of the factors, which treat the leading dimension as a batch
+    projs = [Projection(cons, device) for cons in params.cons]
+
+    if update_way:
+        maj = list(reversed(range(params.n_facts)))
+    else:
+        maj = list(range(params.n_facts))
+
+    chain = ChainCache(facts, update_way)
+    for i in range(params.n_iter):
+        chain.begin_sweep()
+        for j in maj:
+            if projs[j].is_const:
+                facts[j] = projs[j](facts[j])
+            else:
+                L = chain.lefts[j]
+                R = chain.rights[j]
+                lam = lambda_.view(B, 1, 1).to(dtype)
+                S = facts[j]
+
+                # Gradient lambda*L'*(lambda*L*S*R - X)*R'
+                res = S if L is None else L @ S
+                res = res if R is None else res @ R
+                res = lam * res - X
+                grad = res if L is None else L.mH @ res
+                grad = lam * (grad if R is None else grad @ R.mH)
+
+                # Lipschitz modulus, with a few cold-start power iterations
+                n_power = power_iter if i else 10 * power_iter
+                norm_L, v_L[j] = _sq_norm2(L, v_L[j], n_power)
+                norm_R, v_R[j] = _sq_norm2(None if R is None else R.mH, v_R[j], n_power)
+                LC = lambda_**2 * norm_L * norm_R
+                if lipschitz == 'power':
+                    LC = lipschitz_margin * LC
+                c = (LC * 1.001).view(B, 1, 1).to(dtype)
+                facts[j] = projs[j](S - grad / c, out=S)
+            chain.update(j)
+
+        L, S, R = chain.last()
+        D = L[0] @ S if L else S @ R[0] if R else S
+        XD = _inner(X, D)
+        DD = _inner(D, D)
+        lambda_ = XD / DD
+
+    if params.n_iter == 0:
+        D = facts[0]
+        for fact in facts[1:]:
+            D = D @ fact
+        XD = _inner(X, D)
+        DD = _inner(D, D)
+    errors = torch.sqrt(torch.clamp(X_norm2 - 2 * lambda_ * XD + lambda_**2 * DD, min=0) / X_norm2)
+    return lambda_, facts, errors
@@ -1 +1,2 @@
-from .proxs import *
\ No newline at end of file
+from .proxs import *
+from .registry import Projection, enable_compile_cache, register_constraint
@@ -5,125 +5,158 @@ def normc(x):
     """Normalization of a matrix.
     y = normc(x) normalizes the columns of x, and puts the result in y.
     """
-    n = 1 / (x**2).sum(dim=0).sqrt()
-    y = x * n
-    y[~torch.isfinite(y)] = 1.
-    return y
+    return _normalize(x, 1., -2)
 
 
-def prox_sp(X, s):
+def _normalize(X, s, dim, out=None):
+    """X with its slices along dim scaled to norm s in a single pass (the
+    entries of zero slices are set to s), written into out if given."""
+    scale = s / torch.linalg.vector_norm(X, dim=dim, keepdim=True)
+    Xprox = torch.where(torch.isfinite(scale), X * scale, s)
+    if out is not None:
+        return out.copy_(Xprox)
+    return Xprox
+
+
+def _buffer(X, out):
+    """Zeroed output buffer of the shape of X (out is reused if given)."""
+    if out is None:
+        return torch.zeros_like(X)
+    return out.zero_()
+
+
+def _fro(x):
+    """Frobenius norm over the last two dimensions, broadcastable against x."""
+    return torch.linalg.vector_norm(x, dim=(-2, -1), keepdim=True)
+
+
+def _select(X, Xabs, k, dim, out):
+    """Keeps the k entries of X of largest magnitude along dim (whose
+    magnitudes are Xabs) and normalizes the result, writing it into out.
+
+    Only a partial selection (topk) is performed, and the normalization is
+    computed on the selected values only.
+    """
+    N = X.size(dim)
+    if 2 * k <= N:
+        _, index = torch.topk(Xabs, k, dim=dim, sorted=False)
+        values = X.gather(dim, index)
+        values = values / _fro(values)
+        out = _buffer(X, out)
+        out.scatter_(dim, index, values.to(out.dtype))
+    else:
+        # Cheaper to select the N-k entries to discard
+        _, index = torch.topk(Xabs, N - k, dim=dim, largest=False, sorted=False)
+        out = X.clone() if out is None else out.copy_(X)
+        out.scatter_(dim, index, 0.)
+        out /= _fro(out)
+    return out
+
+
+def prox_sp(X, s, out=None):
     """Projection onto the set of sparse matrices of unit Frobenius norm.
 
     Xprox = prox_sp(X,s) projects the input matrix X onto the set of
     matrices which have at most s non-zero entries and unit Frobenius norm.
-    Xprox is the projection of X onto this set.
+    Xprox is the projection of X onto this set. Leading dimensions of X are
+    treated as a batch of matrices. If given, the result is written in out.
     """
-    Xabs = X.abs()
-    Xprox = torch.zeros_like(X)
-    N = X.numel()
-    
-    _, sorted_index = torch.sort(Xabs.view(-1), descending=True)
-    max_index = sorted_index[:round(min(s, N))]
-    Xprox_ = Xprox.view(-1)
-    Xprox_[max_index] = X.view(-1)[max_index]
-    Xprox = Xprox_.view_as(X)
-    
-    Xprox = Xprox / torch.linalg.norm(Xprox, 'fro')
-    return Xprox
+    N = X.size(-2) * X.size(-1)
+    k = round(min(s, N))
+    Xflat = X.reshape(*X.shape[:-2], 1, N)
+    out_flat = None if out is None else out.view(*X.shape[:-2], 1, N)
+    Xprox = _select(Xflat, Xflat.abs(), k, -1, out_flat)
+    return Xprox.view_as(X)
 
 
-def prox_spcol(X, s):
-    """Projection onto the set of matrices with sparse columns and 
+def prox_spcol(X, s, out=None):
+    """Projection onto the set of matrices with sparse columns and
     unit Frobenius norm.
 
     Xprox = prox_spcol(X,s) projects the input matrix X onto the set of
-    matrices which have at most s non-zero entries per column and unit 
+    matrices which have at most s non-zero entries per column and unit
     Frobenius norm. Xprox is the projection of X onto this set.
     """
-    Xabs = X.abs()
-    Xprox = torch.zeros_like(X)
+    k = round(min(s, X.size(-2)))
+    return _select(X, X.abs(), k, -2, out)
 
-    _, sorted_index = torch.sort(Xabs, dim=0, descending=True)
-    max_index = sorted_index[:round(s), :]
-    col_index = torch.arange(X.size(1)).expand_as(max_index)
 
-    Xprox[max_index, col_index] = X[max_index, col_index]
-    Xprox = Xprox / torch.linalg.norm(Xprox, 'fro')
-    return Xprox
+def prox_splin(X, s, out=None):
+    """Projection onto the set of matrices with sparse rows and unit Frobenius
+    norm.
 
+    Xprox = prox_splin(X,s) projects the input matrix X onto the set of
+    matrices which have at most s non-zero entries per row and unit
+    Frobenius norm. Xprox is the projection of X onto this set.
+    """
+    k = round(min(s, X.size(-1)))
+    return _select(X, X.abs(), k, -1, out)
 
-def prox_normcol(X, s):
+
+def prox_normcol(X, s, out=None):
     """Projection onto the set of normalized matrices.
 
     Xprox = prox_normcol(X,s) projects the input matrix X onto the set of
     matrices which have all columns of norm s. Xprox is the projection of X
     onto this set.
     """
-    Xprox = s * normc(X)
-    return Xprox
+    return _normalize(X, s, -2, out)
 
 
-def prox_normlin(X, s):
+def prox_normlin(X, s, out=None):
     """Projection onto the set of normalized matrices.
 
-    Xprox = prox_normcol(X,s) projects the input matrix X onto the set of
-    matrices which have all columns of norm s. Xprox is the projection of X
+    Xprox = prox_normlin(X,s) projects the input matrix X onto the set of
+    matrices which have all rows of norm s. Xprox is the projection of X
     onto this set.
     """
-    Xprox = prox_normcol(X.T, s).T
-    return Xprox
+    return _normalize(X, s, -1, out)
 
 
-def prox_pos(X):
+def prox_pos(X, out=None):
     """Projection onto the set of positive matrices of unit Frobenius norm.
 
     Xprox = prox_pos(X) projects the input matrix X onto the set of positive
     matrices which have unit Frobenius norm.
     Xprox is the projection of X onto this set.
     """
-    Xprox = X * (X > 0)
-    Xprox = Xprox / torch.linalg.norm(Xprox, 'fro')
+    Xprox = torch.clamp(X, min=0, out=out)
+    Xprox /= _fro(Xprox)
     return Xprox
 
 
-def prox_sp_pos(X, s):
-    """Projection onto the set of sparse positive matrices of unit Frobenius 
+def prox_sp_pos(X, s, out=None):
+    """Projection onto the set of sparse positive matrices of unit Frobenius
     norm.
 
     Xprox = prox_sp_pos(X) projects the input matrix X onto the set of
     positive matrices which have at most s non-zero entries and unit
     Frobenius norm. Xprox is the projection of X onto this set.
     """
-    Xprox = prox_sp(prox_pos(X), s)
-    return Xprox
-
-
-def prox_spcol(X, s):
-    """Projection onto the set of matrices with sparse columns and 
-    unit Frobenius norm.
-
-    Xprox = prox_spcol(X,s) projects the input matrix X onto the set of
-    matrices which have at most s non-zero entries per column and unit 
-    Frobenius norm. Xprox is the projection of X onto this set.
+    # The positive part is selected on directly, the normalization of
+    # prox_pos being absorbed by the one of prox_sp.
+    N = X.size(-2) * X.size(-1)
+    k = round(min(s, N))
+    Xflat = X.reshape(*X.shape[:-2], 1, N)
+    Xpos = Xflat.clamp(min=0)
+    out_flat = None if out is None else out.view(*X.shape[:-2], 1, N)
+    Xprox = _select(Xpos, Xpos, k, -1, out_flat)
+    return Xprox.view_as(X)
+
+
+def prox_supp(X, index, out=None):
+    """Projection onto the set of matrices of fixed support and unit
+    Frobenius norm.
+
+    Xprox = prox_supp(X,index) projects the input matrix X onto the set of
+    matrices whose non-zero entries are among the entries of flat indices
+    index (see utils.support.Support) and which have unit Frobenius norm.
+    Only the entries of the support are read.
     """
-    Xabs = X.abs()
-    Xprox = torch.zeros_like(X)
-
-    _, sorted_index = torch.sort(Xabs, dim=0, descending=True)
-    max_index = sorted_index[:round(s), :]
-    col_index = torch.arange(X.size(1)).expand_as(max_index)
-    Xprox[max_index, col_index] = X[max_index, col_index]
-    Xprox = Xprox / torch.linalg.norm(Xprox, 'fro')
+    N = X.size(-2) * X.size(-1)
+    Xflat = X.reshape(*X.shape[:-2], 1, N)
+    values = Xflat[..., index]
+    values = values / _fro(values)
+    Xprox = _buffer(X, out)
+    Xprox.view(*X.shape[:-2], 1, N)[..., index] = values.to(Xprox.dtype)
     return Xprox
-
-
-def prox_splin(X, s):
-    """Projection onto the set of matrices with sparse rows and unit Frobenius 
-    norm.
-
-    Xprox = prox_splin(X,s) projects the input matrix X onto the set of
-    matrices which have at most s non-zero entries per row and unit 
-    Frobenius norm. Xprox is the projection of X onto this set.
-    """
-    Xprox = prox_spcol(X.T, s).T
-    return Xprox
\ No newline at end of file
@@ -0,0 +1,127 @@
+import os
+import torch
+
+from utils.support import constraint_support
+from .proxs import prox_normcol, prox_normlin, prox_pos, prox_sp, prox_sp_pos, prox_spcol, prox_splin, prox_supp
+
+
+# Factories of the projections, by constraint name: factory(cons, device)
+# returns the function (x, out=None) -> projection of x onto the set cons
+_REGISTRY = {}
+# Projections of the values of a factor whose support is frozen, by
+# constraint name
+_ON_SUPPORT = {}
+
+
+def register_constraint(name, factory, on_support=None):
+    """Registration of a type of constraint.
+
+    register_constraint(name, factory) makes the constraints
+    {name, parameter, m, n} usable in palm4msa and hierarchical:
+    factory(cons, device) is called once per factor and returns the
+    projection proj(x, out=None) of the matrix x (or batch of matrices) on
+    device onto the constraint set, written into out if given.
+
+    If the support of the factors of the constraint can be frozen (see the
+    option freeze_stable of palm4msa), on_support(values) projects the
+    vector of the values of a factor on its support onto the constraint
+    set restricted to this support.
+    """
+    _REGISTRY[name] = factory
+    if on_support is not None:
+        _ON_SUPPORT[name] = on_support
+    else:
+        _ON_SUPPORT.pop(name, None)
+
+
+def _prox_factory(prox):
+    def factory(cons, device):
+        s = cons[1]
+
+        def proj(x, out=None):
+            return prox(x, s, out)
+        return proj
+    return factory
+
+
+def _const(cons, device):
+    C = torch.as_tensor(cons[1], device=device)
+
+    def proj(x, out=None):
+        return C.to(device=x.device, dtype=x.dtype).expand_as(x)
+    return proj
+
+
+def _pos(cons, device):
+    return prox_pos
+
+
+def _supp(cons, device):
+    index = constraint_support(cons).index.to(device)
+
+    def proj(x, out=None):
+        return prox_supp(x, index, out)
+    return proj
+
+
+def _unit(values):
+    return values / torch.linalg.vector_norm(values)
+
+
+def _unit_pos(values):
+    return _unit(values.clamp(min=0))
+
+
+register_constraint('sp', _prox_factory(prox_sp), _unit)
+register_constraint('spcol', _prox_factory(prox_spcol), _unit)
+register_constraint('splin', _prox_factory(prox_splin), _unit)
+register_constraint('normcol', _prox_factory(prox_normcol))
+register_constraint('normlin', _prox_factory(prox_normlin))
+register_constraint('sppos', _prox_factory(prox_sp_pos), _unit_pos)
+register_constraint('pos', _pos)
+register_constraint('const', _const)
+register_constraint('blockdiag', _supp, _unit)
+register_constraint('butterfly', _supp, _unit)
+register_constraint('supp', _supp, _unit)
+
+
+def enable_compile_cache(directory):
+    """Persistent cache of the kernels compiled by torch.compile in
+    directory, reused by the next processes."""
+    os.makedirs(directory, exist_ok=True)
+    os.environ['TORCHINDUCTOR_CACHE_DIR'] = directory
+    torch._inductor.config.fx_graph_cache = True
+
+
+class Projection:
+    """Projection onto the constraint set of one factor.
+
+    proj = Projection(cons, device) binds the constraint cons = {name,
+    parameter, m, n} to its projection (see register_constraint) once;
+    proj(x, out=None) then projects x. If compile is True, the projection
+    is compiled with torch.compile, which fuses its selection and
+    normalization steps into a few kernels.
+
+    If the support of the factor can be frozen, proj.on_support(values)
+    projects the values of the factor on its support (None otherwise).
+    """
+
+    def __init__(self, cons, device='cpu', compile=False):
+        if cons[0] not in _REGISTRY:
+            raise Exception('The expressed type of constraint is not known')
+        self.cons = cons
+        self.name = cons[0]
+        self.fn = _REGISTRY[self.name](cons, device)
+        self.on_support = _ON_SUPPORT.get(self.name)
+        if compile and self.name != 'const':
+            self.fn = torch.compile(self.fn, dynamic=False)
+
+    @property
+    def is_const(self):
+        return self.name == 'const'
+
+    def __call__(self, x, out=None):
+        return self.fn(x, out)
+
+    def __repr__(self):
+        return f'Projection({self.name!r})'
@@ -0,0 +1,132 @@
+from easydict import EasyDict
+from palm4msa import palm4msa
+from utils import lambda_comp, error_comp
+from utils.lambda_comp import inner
+from utils.sparse import to_dense
+from utils.general import check_device, check_dtype, check_precision
+
+
+def final_cons(cons, fact_side=0):
+    """Constraints of the factors returned by hierarchical, from its
+    constraints cons (2*(nfacts-1)) and fact_side."""
+    if fact_side:
+        return [cons[0][-1]] + cons[1][::-1]
+    return cons[0] + [cons[1][-1]]
+
+
+def fit_error(X, facts):
+    """Relative error of lambda*facts{1}*...*facts{n} with respect to X for
+    the lambda minimizing it, and this lambda."""
+    facts = [to_dense(fact) for fact in facts]
+    lambda_opt, XD, DD = lambda_comp(facts[:1], facts[1], facts[2:], X) if len(facts) > 1 \
+        else lambda_comp([], facts[0], [], X)
+    X_norm2 = inner(X, X)
+    error = error_comp(lambda_opt, XD, DD, X_norm2)
+    return float((error / X_norm2).sqrt()), float(lambda_opt)
+
+
+def refactorize(params):
+    """Update of a factorization for a new data matrix.
+
+    [lambda, facts] = refactorize(params) refines the factorization
+    lambda*facts{1}*...*facts{n} of a previous matrix (e.g. returned by
+    hierarchical) so that it approximates the new matrix params.data,
+    starting from the old factors instead of factorizing from scratch.
+    lambda is first refitted to the new matrix.
+
+    The refinement goes by levels, following the order in which hierarchical
+    introduced the factors (see fact_side): the first level refines the
+    first two factors with palm4msa, each following one refines one more
+    factor, and the factors which are not refined are constant, so that
+    their updates are skipped. Before the first level and after each one,
+    the relative error is compared to tol and the remaining levels are
+    skipped once it is reached, so that a matrix which changed little costs
+    a refit of lambda or a few short PALM runs on some of the factors. The
+    last level refines all the factors.
+
+    Required fields in PARAMS:
+    --------------------------
+
+    'data' - New data matrix.
+
+    'facts' - Factors of the previous factorization. Its scalar is refitted
+        to the new matrix.
+
+    'cons' - Constraint sets of the factors, as in palm4msa (use
+        final_cons(cons, fact_side) to get them from the constraints given to
+        hierarchical).
+
+    Optional fields in PARAMS:
+    --------------------------
+
+    'tol' - Relative error under which the update stops. The default value
+        is 0: all the levels are run.
+
+    'niter' - Number of PALM iterations per level. The default value is 100.
+
+    'fact_side' - Side which was factorized iteratively by hierarchical:
+        the levels introduce the factors from the left (0) or from the right
+        (1). The default value is 0.
+
+    'freeze_supports' - If True, the factors keep the supports of the old
+        factors: only their values are refined (freeze_iter = 0 in
+        palm4msa). The default value is False.
+
+    'return_info' - If True, refactorize returns lambda, facts, info where
+        info holds the relative error before the update ('init_error') and
+        after it ('rel_error'), the total number of PALM iterations
+        ('n_iter') and the PALM info of each level which was run ('levels').
+
+    Other fields (e.g. device, precision, update_way, sparse_threshold,
+    stopping criteria) are passed to palm4msa.
+    """
+    params = EasyDict(params)
+    n_iter = params.get('n_iter', 100)
+    tol = params.get('tol', 0)
+    fact_side = params.get('fact_side', 0)
+    freeze_supports = params.get('freeze_supports', False)
+    return_info = params.pop('return_info', False)
+    device = params.get('device', 'cpu')
+    dtype, _ = check_precision(params.get('precision', 'double'), params.data.dtype.is_complex)
+
+    facts = [check_dtype(check_device(to_dense(fact), device), dtype) for fact in params.facts]
+    n_facts = len(facts)
+    if len(params.cons) != n_facts:
+        raise Exception('The number of constraints is in conflict with the number of factors')
+    for fact, cons in zip(facts, params.cons):
+        if tuple(fact.shape) != (cons[2], cons[3]):
+            raise Exception('Size incompatibility between the factors and the constraints')
+
+    X = check_dtype(check_device(params.data, device), dtype)
+    cons = list(params.cons)
+
+    # Factors refined at each level
+    order = list(range(n_facts)) if not fact_side else list(range(n_facts-1, -1, -1))
+    levels = [order[:k+1] for k in range(1, n_facts)]
+
+    init_error, lambda_ = fit_error(X, facts)
+    error = init_error
+    infos = []
+    for free in levels:
+        if error <= tol:
+            break
+        params_palm = EasyDict(params)
+        params_palm.update(
+            data=X,
+            n_facts=n_facts,
+            n_iter=n_iter,
+            cons=[c if j in free else ['const', to_dense(facts[j]), c[2], c[3]] for j, c in enumerate(cons)],
+            init_facts=list(facts),
+            init_lambda=lambda_,
+            return_info=True,
+        )
+        if freeze_supports:
+            params_palm.freeze_iter = 0
+        lambda_, facts, info = palm4msa(params_palm)
+        error = float(info.rel_error)
+        infos.append(info)
+
+    if return_info:
+        return lambda_, facts, EasyDict(
+            init_error=init_error, rel_error=error, n_iter=sum(info.n_iter for info in infos), levels=infos)
+    return lambda_, facts
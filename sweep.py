@@ -0,0 +1,91 @@
+import os
+import time
+import torch
+import torch.multiprocessing as mp
+
+from easydict import EasyDict
+from hierarchical import hierarchical
+
+
+# Data of the worker processes, set once by _init_worker
+_worker_data = None
+
+
+def _init_worker(data, n_threads):
+    global _worker_data
+    _worker_data = data
+    # One pool of intra-op threads per worker, to avoid oversubscription
+    torch.set_num_threads(n_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+
+def _run_config(item):
+    index, config, return_facts = item
+    params = EasyDict(config)
+    params.data = _worker_data
+    start = time.perf_counter()
+    lambda_, facts, errors = hierarchical(params)
+    result = EasyDict(
+        index=index,
+        config=config,
+        rel_error=float(errors[-1, 0]),
+        density=float(errors[-1, 1]),
+        lambda_=float(lambda_),
+        errors=errors,
+        time=time.perf_counter() - start,
+    )
+    if return_facts:
+        result.facts = facts
+    return result
+
+
+def pareto_front(results):
+    """Marks (result.pareto) the results for which no other result has both a
+    lower or equal relative error and a lower or equal density, one of them
+    being strictly lower. The results are returned sorted by density."""
+    results = sorted(results, key=lambda r: (r.density, r.rel_error))
+    best_error = float('inf')
+    for r in results:
+        r.pareto = r.rel_error < best_error
+        best_error = min(best_error, r.rel_error)
+    return results
+
+
+def hierarchical_sweep(data, configs, n_workers=None, n_threads=1, return_facts=False):
+    """Hierarchical factorizations of a matrix for several sets of parameters.
+
+    table = hierarchical_sweep(data, configs) runs hierarchical on data for
+    each dict of parameters in configs (every field of hierarchical except
+    'data': 'cons', 'n_facts', 'fact_side', 'update_way', 'n_iter1', ...)
+    in a pool of processes, and returns the Pareto table of the relative
+    error versus the density (nnz / numel) of the factorizations: one
+    EasyDict per configuration with the fields 'index', 'config',
+    'rel_error', 'density', 'lambda_', 'errors', 'time' and 'pareto', sorted
+    by density.
+
+    data is moved to shared memory once and mapped by the workers, instead
+    of being pickled for each configuration.
+
+    'n_workers' - Number of processes. The default value is the number of
+        CPUs divided by n_threads.
+
+    'n_threads' - Number of intra-op threads of each worker. The default
+        value is 1.
+
+    'return_facts' - If True, the factors are returned in the field 'facts'
+        of each result (they are then sent back from the workers). The
+        default value is False.
+    """
+    if n_workers is None:
+        n_workers = max(1, (os.cpu_count() or 1) // n_threads)
+    data = data.detach().cpu().contiguous()
+    data.share_memory_()
+
+    items = [(i, dict(config), return_facts) for i, config in enumerate(configs)]
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(n_workers, initializer=_init_worker, initargs=(data, n_threads)) as pool:
+        results = pool.map(_run_config, items, chunksize=1)
+    return pareto_front(results)
@@ -1,6 +1,8 @@
+from .chain_cache import ChainCache
 from .dvp import dvp
 from .grad_comp import grad_comp
 from .grad_comp_cpx import grad_comp_cpx
+from .lambda_comp import lambda_comp, error_comp
 from .mult_left import mult_left
 from .mult_right import mult_right
 from .nnzero_count import nnzero_count
\ No newline at end of file
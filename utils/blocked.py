@@ -0,0 +1,113 @@
+import torch
+
+from .chain_order import chain_prod
+from .lambda_comp import inner
+from .sparse import adjoint, to_dense
+
+
+def _open(data):
+    """Row-sliceable array from a tensor, a numpy (memory-mapped) array or a
+    path to a .npy or .pt file, without reading it."""
+    if isinstance(data, str):
+        if data.endswith('.npy'):
+            import numpy as np
+            return np.load(data, mmap_mode='r')
+        return torch.load(data, map_location='cpu', mmap=True, weights_only=True)
+    return data
+
+
+class BlockedData:
+    """Data matrix kept out of memory and accessed by blocks of rows.
+
+    X = BlockedData(data, block_rows) wraps data, a (memory-mapped) numpy
+    array, a tensor (e.g. created by torch.from_file or loaded with mmap)
+    or the path of a .npy or .pt file, which is never loaded as a whole:
+    the products involving X are streamed over blocks of block_rows rows,
+    each block being converted to dtype and moved to device on its own. The
+    peak memory is thus that of a block_rows*n block, plus the products.
+
+    It can be given as params.data to palm4msa and hierarchical: the
+    gradients and lambda are computed from L'*X*R' (see project) and the
+    Gram matrices of the factorized products, as for a Sketch.
+    """
+
+    def __init__(self, data, block_rows=1024, dtype=None, device='cpu'):
+        self.data = _open(data)
+        self.block_rows = block_rows
+        self.shape = tuple(self.data.shape)
+        if len(self.shape) != 2:
+            raise Exception(f'Data must be a matrix, received an array of dimension {len(self.shape)}')
+        self.device = torch.device(device)
+        self.dtype = None
+        self.dtype = dtype if dtype is not None else self.block(0, 1).dtype
+        self._norm2 = None
+
+    def to(self, dtype=None, device=None):
+        """View of the same data with blocks converted to dtype and moved to
+        device."""
+        dtype = self.dtype if dtype is None else dtype
+        device = self.device if device is None else torch.device(device)
+        if dtype == self.dtype and device == self.device:
+            return self
+        X = BlockedData.__new__(BlockedData)
+        X.__dict__.update(self.__dict__)
+        X.dtype, X.device = dtype, device
+        return X
+
+    def size(self, dim=None):
+        return self.shape if dim is None else self.shape[dim]
+
+    def numel(self):
+        return self.shape[0] * self.shape[1]
+
+    def block(self, start, stop, dtype=None):
+        """Rows start to stop-1 of the data, as a tensor."""
+        rows = self.data[start:stop]
+        rows = rows if torch.is_tensor(rows) else torch.tensor(rows)
+        return rows.to(device=self.device, dtype=self.dtype if dtype is None else dtype)
+
+    def blocks(self, dtype=None):
+        """Iterator over (start, stop, rows start to stop-1)."""
+        for start in range(0, self.shape[0], self.block_rows):
+            stop = min(start + self.block_rows, self.shape[0])
+            yield start, stop, self.block(start, stop, dtype)
+
+    @property
+    def norm2(self):
+        """|| X ||^2, accumulated in float64 (computed once)."""
+        if self._norm2 is None:
+            dtype = torch.complex128 if self.dtype.is_complex else torch.float64
+            self._norm2 = sum(inner(block, block) for _, _, block in self.blocks(dtype))
+        return self._norm2.to(self.device)
+
+    def mm(self, M):
+        """X*M, one block of rows at a time."""
+        out = torch.empty(self.shape[0], M.size(1), dtype=self.dtype, device=self.device)
+        for start, stop, block in self.blocks():
+            out[start:stop] = block @ M
+        return out
+
+    def tmm(self, M):
+        """X'*M (X' being the conjugate transpose), accumulated over the
+        blocks of rows."""
+        out = torch.zeros(self.shape[1], M.size(1), dtype=self.dtype, device=self.device)
+        for start, stop, block in self.blocks():
+            out += block.mH @ M[start:stop]
+        return out
+
+    def project(self, L, R):
+        """L'*X*R' for L and R in factorized form, accumulated over the blocks
+        of rows of X: sum_i L(rows_i,:)'*(X(rows_i,:)*R')."""
+        Rt = to_dense(chain_prod([adjoint(fact) for fact in reversed(R)])) if R else None
+        Lt = to_dense(chain_prod([adjoint(fact) for fact in reversed(L)])) if L else None
+        out = None
+        for start, stop, block in self.blocks():
+            XR = block if Rt is None else block @ Rt
+            if Lt is None:
+                if out is None:
+                    out = torch.empty(self.shape[0], XR.size(1), dtype=XR.dtype, device=XR.device)
+                out[start:stop] = XR
+            else:
+                LXR = Lt[:, start:stop] @ XR
+                out = LXR if out is None else out.add_(LXR)
+        return out
@@ -0,0 +1,74 @@
+from .sparse import density, is_sparse, to_dense
+
+
+class ChainCache:
+    """Cache of the partial products of a factorized matrix.
+
+    chain = ChainCache(facts, update_way) keeps the products
+    L{j} = facts{1}*...*facts{j-1} and R{j} = facts{j+1}*...*facts{n} of the
+    cell-array of matrices facts, so that a sweep of PALM over the n factors
+    costs O(n) matrix products instead of O(n^2).
+
+    At the beginning of each sweep, begin_sweep() rebuilds the products on
+    the side which is not updated yet (the right products if
+    update_way = 0, the left ones if update_way = 1). Each time facts{j}
+    has been updated, update(j) extends the products on the other side
+    with the new factor.
+
+    Products of factors stored in a sparse format stay sparse as long as
+    their density is lower than sparse_threshold, and are dense otherwise.
+    """
+
+    def __init__(self, facts, update_way=0, sparse_threshold=0):
+        self.facts = facts
+        self.update_way = update_way
+        self.sparse_threshold = sparse_threshold
+        self.lefts = [None] * len(facts)
+        self.rights = [None] * len(facts)
+
+    def begin_sweep(self):
+        n_facts = len(self.facts)
+        if self.update_way:
+            self.lefts[0] = None
+            for j in range(1, n_facts):
+                self.lefts[j] = self._mul(self.lefts[j-1], self.facts[j-1])
+            self.rights[n_facts-1] = None
+        else:
+            self.rights[n_facts-1] = None
+            for j in range(n_facts-2, -1, -1):
+                self.rights[j] = self._mul(self.facts[j+1], self.rights[j+1])
+            self.lefts[0] = None
+
+    def update(self, j):
+        if self.update_way:
+            if j > 0:
+                self.rights[j-1] = self._mul(self.facts[j], self.rights[j])
+        else:
+            if j < len(self.facts) - 1:
+                self.lefts[j+1] = self._mul(self.lefts[j], self.facts[j])
+
+    def left(self, j):
+        """Factorized form (cell-array of 0 or 1 matrix) of facts{1}*...*facts{j-1}."""
+        return [] if self.lefts[j] is None else [self.lefts[j]]
+
+    def right(self, j):
+        """Factorized form (cell-array of 0 or 1 matrix) of facts{j+1}*...*facts{n}."""
+        return [] if self.rights[j] is None else [self.rights[j]]
+
+    def last(self):
+        """Factorized form [L, S, R] of the whole product around the factor
+        updated last in the sweep (L and R hold 0 or 1 matrix)."""
+        if self.update_way:
+            return [], self.facts[0], self.right(0)
+        n_facts = len(self.facts)
+        return self.left(n_facts-1), self.facts[n_facts-1], []
+
+    def _mul(self, A, B):
+        if A is None:
+            return B
+        if B is None:
+            return A
+        AB = A @ B
+        if is_sparse(AB) and density(AB) >= self.sparse_threshold:
+            AB = to_dense(AB)
+        return AB
@@ -0,0 +1,77 @@
+import math
+from functools import lru_cache
+
+from .sparse import is_sparse, nnz
+
+
+def _bucket(n):
+    """nnz rounded on a quarter-octave grid, so that plans are shared between
+    factors whose numbers of non-zeros only slightly differ."""
+    if n <= 0:
+        return 0
+    return int(round(2 ** (round(4 * math.log2(n)) / 4)))
+
+
+def chain_signature(D):
+    """Signature (rows, cols, nnz or None if dense) of each matrix of D."""
+    return tuple(
+        (x.size(0), x.size(1), _bucket(nnz(x)) if is_sparse(x) else None)
+        for x in D
+    )
+
+
+def _prod_cost(a, b):
+    """Multiply-adds of the product of a (m*k) by b (k*n), given as signatures."""
+    m, k, nnz_a = a
+    _, n, nnz_b = b
+    cost = m * k * n
+    if nnz_a is not None:
+        cost = min(cost, nnz_a * n)
+    if nnz_b is not None:
+        cost = min(cost, nnz_b * m)
+    return cost
+
+
+@lru_cache(maxsize=1024)
+def chain_plan(signature):
+    """Optimal multiplication order of a chain of matrices.
+
+    [cost, plan] = chain_plan(signature) computes, by dynamic programming,
+    the parenthesization of the product D{1}*...*D{n} of cost (multiply-adds)
+    minimal, D being described by its signature (see chain_signature). plan
+    is a nested tuple of indices: (0, (1, 2)) stands for D{1}*(D{2}*D{3}).
+    Sparse matrices cost nnz per column of the other operand, intermediate
+    products are dense. Plans are cached by signature.
+    """
+    n = len(signature)
+    cost = [[0] * n for _ in range(n)]
+    plan = [[i if i == j else None for j in range(n)] for i in range(n)]
+    # Signature of the product D{i}*...*D{j}
+    sign = [[signature[i] if i == j else None for j in range(n)] for i in range(n)]
+    for length in range(2, n + 1):
+        for i in range(0, n - length + 1):
+            j = i + length - 1
+            sign[i][j] = (signature[i][0], signature[j][1], None)
+            for k in range(i, j):
+                c = cost[i][k] + cost[k+1][j] + _prod_cost(sign[i][k], sign[k+1][j])
+                if plan[i][j] is None or c < cost[i][j]:
+                    cost[i][j] = c
+                    plan[i][j] = (plan[i][k], plan[k+1][j])
+    return cost[0][n-1], plan[0][n-1]
+
+
+def _run(D, plan):
+    if isinstance(plan, int):
+        return D[plan]
+    return _run(D, plan[0]) @ _run(D, plan[1])
+
+
+def chain_prod(D):
+    """Product D{1}*...*D{n} computed in the optimal order of chain_plan."""
+    if len(D) <= 2:
+        y = D[0]
+        for x in D[1:]:
+            y = y @ x
+        return y
+    _, plan = chain_plan(chain_signature(D))
+    return _run(D, plan)
@@ -0,0 +1,107 @@
+import os
+import torch
+
+from easydict import EasyDict
+
+from .sparse import density, to_dense
+
+
+def pack_fact(fact, threshold=0.5):
+    """Compact version of a factor for storage: its non-zero entries and
+    their (int32) indices if its density is lower than threshold, the dense
+    tensor otherwise."""
+    if not torch.is_tensor(fact):
+        return None
+    fact = to_dense(fact).detach().cpu()
+    if fact.ndim != 2 or density(fact) >= threshold:
+        return fact
+    index = fact.nonzero().T.to(torch.int32)
+    return {'shape': list(fact.shape), 'index': index, 'values': fact[index[0].long(), index[1].long()]}
+
+
+def unpack_fact(packed):
+    """Dense factor from the output of pack_fact."""
+    if packed is None or torch.is_tensor(packed):
+        return packed
+    fact = torch.zeros(packed['shape'], dtype=packed['values'].dtype)
+    index = packed['index'].long()
+    fact[index[0], index[1]] = packed['values']
+    return fact
+
+
+def save_state(path, state):
+    """Atomic save of state (a dict of tensors, numbers, strings, lists and
+    dicts) to path: the file is either the previous or the new state, even
+    if the process is killed during the save."""
+    tmp = f'{path}.tmp'
+    torch.save(state, tmp)
+    os.replace(tmp, path)
+
+
+def load_state(path):
+    """State saved by save_state, None if there is no file at path."""
+    if not os.path.exists(path):
+        return None
+    return torch.load(path, map_location='cpu', weights_only=True)
+
+
+def _plain(x):
+    """x with its (Easy)dicts converted to plain dicts, for weights_only loading."""
+    if isinstance(x, dict):
+        return {key: _plain(value) for key, value in x.items()}
+    if isinstance(x, (list, tuple)):
+        return [_plain(value) for value in x]
+    return x
+
+
+def _easy(x):
+    if isinstance(x, dict):
+        return EasyDict({key: _easy(value) for key, value in x.items()})
+    if isinstance(x, list):
+        return [_easy(value) for value in x]
+    return x
+
+
+def save_checkpoint(directory, params, k, stage, lambda_, facts, errors, levels, palm=None, level=False):
+    """Saves the state of hierarchical at level k, before the stage 'split'
+    or 'glob', into directory/state.pt (and directory/level_k.pt if level).
+    palm is the state (iter, lambda_, facts) of the PALM run in progress."""
+    os.makedirs(directory, exist_ok=True)
+    state = {
+        'n_facts': params.n_facts,
+        'shape': list(params.data.shape),
+        'k': k,
+        'stage': stage,
+        'lambda_': lambda_,
+        'facts': [pack_fact(fact) for fact in facts],
+        'errors': errors.detach().cpu(),
+        'levels': _plain(levels),
+        'palm': None,
+    }
+    if palm is not None:
+        state['palm'] = {
+            'iter': palm.iter,
+            'lambda_': palm.lambda_,
+            'facts': [pack_fact(fact) for fact in palm.facts],
+        }
+    save_state(os.path.join(directory, 'state.pt'), state)
+    if level:
+        save_state(os.path.join(directory, f'level_{k}.pt'), state)
+
+
+def load_checkpoint(directory, params, level=None):
+    """State saved by save_checkpoint (the state of the beginning of the
+    global optimisation of level if given), None if there is none."""
+    name = 'state.pt' if level is None else f'level_{level}.pt'
+    state = load_state(os.path.join(directory, name))
+    if state is None:
+        if level is not None:
+            raise Exception(f'No checkpoint of level {level} in {directory}')
+        return None
+    if state['n_facts'] != params.n_facts or state['shape'] != list(params.data.shape):
+        raise Exception('The checkpoint is in conflict with params.n_facts or params.data')
+    state = _easy(state)
+    state.facts = [[] if fact is None else unpack_fact(fact) for fact in state.facts]
+    if state.palm is not None:
+        state.palm.facts = [unpack_fact(fact) for fact in state.palm.facts]
+    return state
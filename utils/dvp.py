@@ -1,19 +1,26 @@
 import torch
 
+from .chain_order import chain_prod
+from .sparse import to_dense
+
 
 def dvp(D, device='cpu'):
     """Development of the input factorized matrix.
 
     Ddvp = dvp(D) develops the cell-array of matrices D into the matrix Ddvp
     which is the product of the matrices contained in D:
-    Ddvp = D{1}*D{2}*...*D{n}.
+    Ddvp = D{1}*D{2}*...*D{n}. Ddvp is dense even if some factors are
+    stored in a sparse format. The products are carried out in the cheapest
+    order (see chain_order.chain_plan).
     """
     n_layers = len(D)
     if n_layers == 0:
         Ddvp = torch.tensor(1., dtype=torch.float64, device=device)
     else:
-        Ddvp = D[0]
+        # Factors not matching the current number of columns are skipped
+        chain = [D[0]]
         for i in range(1, n_layers):
-            if D[i].size(0) == Ddvp.size(1):
-                Ddvp = Ddvp @ D[i]
-    return Ddvp
\ No newline at end of file
+            if D[i].size(0) == chain[-1].size(1):
+                chain.append(D[i])
+        Ddvp = chain_prod(chain)
+    return to_dense(Ddvp)
\ No newline at end of file
@@ -8,6 +8,35 @@ def check_device(tensor, device):
 
 
 def check_dtype(tensor, dtype):
-    if not tensor.dtype != dtype:
+    if tensor.dtype != dtype:
         return tensor.type(dtype)
-    return tensor
\ No newline at end of file
+    return tensor
+
+
+# Precision policies: type of the factors and of the data, and type of the
+# matrix products (None when they are computed in the type of the factors).
+# The scalar quantities (lambda, Lipschitz moduli, errors) are always
+# accumulated in float64.
+PRECISIONS = {
+    'double': (torch.float64, None),
+    'single': (torch.float32, None),
+    'bfloat16': (torch.float32, torch.bfloat16),
+}
+
+
+# Complex counterparts of the types of the factors, for complex data
+COMPLEX_DTYPES = {
+    torch.float64: torch.complex128,
+    torch.float32: torch.complex64,
+}
+
+
+def check_precision(precision, is_complex=False):
+    if precision not in PRECISIONS:
+        raise Exception(f'The expressed precision is not known: {precision}')
+    dtype, prod_dtype = PRECISIONS[precision]
+    if is_complex:
+        if prod_dtype is not None:
+            raise Exception(f'The precision {precision} is not supported for complex data')
+        dtype = COMPLEX_DTYPES[dtype]
+    return dtype, prod_dtype
\ No newline at end of file
@@ -1,36 +1,39 @@
-import torch
-
-from .dvp import dvp
+from .chain_order import chain_prod
+from .lipschitz import ExactLipschitz
 from .mult_left import mult_left
 from .mult_right import mult_right
+from .sparse import adjoint, to_dense
 
 
-def norm(x, ord=2):
-    if not torch.is_tensor(x):
-        raise Exception(f'Input must be a Tensor, received: {type(x)}')
-    
-    if x.ndim == 1:
-        raise Exception(f'Input dimension must be 0 or 2, received: {x.ndim}')
-    
-    if x.ndim == 0:
-        return x
-    else:
-        return torch.linalg.norm(x, ord)
-
-
-def grad_comp(L, S, R, X, lambda_, device='cpu'):
+def grad_comp(L, S, R, X, lambda_, device='cpu', lipschitz=None, support=None, values=False):
     """Computation of the gradient and Lipschitz modulus
 
     [grad, LC] = grad_comp(L,S,R,X,lambda) computes the gradient grad of
     H(L,S,R,lambda) = || X - lambda*L*S*R || and its Lipschitz modulus LC.
+    The estimator of ||L||^2*||R||^2 used for LC can be given in lipschitz
+    (see utils.lipschitz), the exact spectral norms are used by default.
+    For complex data, the transposes are conjugate transposes and lambda is
+    real.
+
+    If the factor has a fixed support (see utils.support.Support), the
+    gradient is only computed on it and is zero elsewhere. If values is
+    True, grad is then the vector of its entries on the support.
     """
     grad_temp = lambda_ * mult_left(L, S)
     grad_temp = mult_right(grad_temp, R)
     grad_temp = grad_temp - X
-    grad_temp = lambda_ * mult_right(grad_temp.T, L)
-    grad_temp = mult_left(R, grad_temp)
-    grad = grad_temp.T
+    grad_temp = lambda_ * mult_right(grad_temp.mH, L)
+    if support is None:
+        grad_temp = mult_left(R, grad_temp)
+        grad = grad_temp.mH
+    elif R:
+        Rt = to_dense(chain_prod([adjoint(fact) for fact in reversed(R)]))
+        grad = support.sample(grad_temp.mH, Rt) if values else support.mm(grad_temp.mH, Rt)
+    else:
+        grad = support.values(grad_temp.mH) if values else support.restrict(grad_temp.mH)
     
     # Compute the Lipschitz constant
-    LC = lambda_**2 * norm(dvp(R, device), 2)**2 * norm(dvp(L, device), 2)**2
+    if lipschitz is None:
+        lipschitz = ExactLipschitz(device)
+    LC = lambda_**2 * lipschitz(L, R)
     return grad, LC
\ No newline at end of file
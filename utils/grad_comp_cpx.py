@@ -1,16 +1,13 @@
-import torch
+from .grad_comp import grad_comp
 
-from .dvp import dvp
 
-
-def grad_comp_cpx(L, S, R, X, lambda_, device='cpu'):
+def grad_comp_cpx(L, S, R, X, lambda_, device='cpu', lipschitz=None, support=None):
     """Computation of the gradient and Lipschitz modulus for complex data
 
     [grad, LC] = grad_comp_cpx(L,S,R,X,lambda) computes the gradient grad of
-    H(L,S,R,lambda) = 1/2|| X - lambda*L*S*R ||F and its Lipschitz modulus LC.
+    H(L,S,R,lambda) = 1/2|| X - lambda*L*S*R ||F and its Lipschitz modulus LC:
+        grad = lambda*L'*(lambda*L*S*R - X)*R'
+    where ' is the conjugate transpose. grad_comp handles complex factors
+    directly (on the factorized products), this is the same computation.
     """
-    grad = lambda_*dvp(L, device).T*(lambda_*dvp(L, device)*S*dvp(R) - X)*dvp(R, device).T
-
-    # Compute the Lipschitz constant
-    LC = lambda_**2 * torch.linalg.norm(dvp(R, device), 2)**2 * torch.linalg.norm(dvp(L, device), 2)**2
-    return grad, LC
\ No newline at end of file
+    return grad_comp(L, S, R, X, lambda_, device, lipschitz, support)
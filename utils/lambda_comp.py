@@ -0,0 +1,58 @@
+import torch
+
+from .chain_order import chain_plan, chain_prod, chain_signature
+from .sparse import adjoint, to_dense
+
+
+def lambda_comp(L, S, R, X):
+    """Computation of the scalar of a factorized matrix without developing it
+
+    [lambda, XD, DD] = lambda_comp(L,S,R,X) computes, for D = L*S*R with L
+    and R in factorized form, the scalar lambda minimizing || X - lambda*D ||
+    along with XD = <X, D> and DD = || D ||^2, so that
+    || X - lambda*D ||^2 = || X ||^2 - 2*lambda*XD + lambda^2*DD.
+
+    Depending on the sizes, either D is developed once, or the Gram matrices
+    of L and R are used: XD = <L'*X*R', S> and DD = <(L'*L)*S*(R*R'), S>.
+    The inner products are accumulated in float64 whatever the type of the
+    factors. For complex data, lambda is real and XD = Re(<X, D>).
+    """
+    S = to_dense(S)
+    Lt = [adjoint(fact) for fact in reversed(L)]
+    Rt = [adjoint(fact) for fact in reversed(R)]
+    k, l = S.shape
+    cost_dvp = chain_plan(chain_signature(L + [S] + R))[0] + 2 * X.numel()
+    cost_gram = chain_plan(chain_signature(Lt + [X] + Rt))[0] + 2 * k * l * (k + l)
+    if L:
+        cost_gram += chain_plan(chain_signature(Lt + L))[0]
+    if R:
+        cost_gram += chain_plan(chain_signature(R + Rt))[0]
+
+    if cost_dvp <= cost_gram:
+        D = to_dense(chain_prod(L + [S] + R))
+        XD = inner(X, D)
+        DD = inner(D, D)
+    else:
+        XD = inner(S, to_dense(chain_prod(Lt + [X] + Rt)))
+        GS = S
+        if L:
+            GS = to_dense(chain_prod(Lt + L)) @ GS
+        if R:
+            GS = GS @ to_dense(chain_prod(R + Rt))
+        DD = inner(S, GS)
+    lambda_ = XD / DD
+    return lambda_, XD, DD
+
+
+def inner(A, B):
+    """Real part of the inner product <A, B> = trace(A'*B) (A' being the
+    conjugate transpose), accumulated in float64."""
+    if A.is_complex():
+        A = torch.view_as_real(A.resolve_conj())
+        B = torch.view_as_real(B.resolve_conj())
+    return (A * B).sum(dtype=torch.float64)
+
+
+def error_comp(lambda_, XD, DD, X_norm2):
+    """Squared error || X - lambda*D ||^2 from the scalars of lambda_comp."""
+    return torch.clamp(X_norm2 - 2 * lambda_ * XD + lambda_**2 * DD, min=0)
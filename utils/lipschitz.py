@@ -0,0 +1,97 @@
+import torch
+
+from .dvp import dvp
+from .mult_left import mult_left
+from .mult_right import mult_right
+from .sparse import adjoint
+
+
+def norm(x, ord=2):
+    if not torch.is_tensor(x):
+        raise Exception(f'Input must be a Tensor, received: {type(x)}')
+
+    if x.ndim == 1:
+        raise Exception(f'Input dimension must be 0 or 2, received: {x.ndim}')
+
+    if x.ndim == 0:
+        return x
+    else:
+        # Computed in float64 when the factors have a lower precision
+        return torch.linalg.norm(x.to(torch.complex128 if x.is_complex() else torch.float64), ord)
+
+
+class ExactLipschitz:
+    """Exact squared spectral norms of the partial products.
+
+    lip = ExactLipschitz(); LC = lip(L, R) returns ||L||_2^2 * ||R||_2^2
+    where L and R are in factorized form, by developing them and computing
+    their spectral norms.
+    """
+
+    def __init__(self, device='cpu'):
+        self.device = device
+
+    def __call__(self, L, R):
+        return norm(dvp(R, self.device), 2)**2 * norm(dvp(L, self.device), 2)**2
+
+
+class PowerLipschitz:
+    """Warm-started power-iteration estimate of the squared spectral norms.
+
+    lip = PowerLipschitz(); LC = lip(L, R) returns an estimate of
+    ||L||_2^2 * ||R||_2^2 where L and R are in factorized form. L and R are
+    only applied to vectors, never developed. The iteration vectors are kept
+    between calls, so that a few iterations are enough once the factors
+    change slowly. One instance should be used per factor.
+
+    'n_iter' - Number of power iterations per call (the first call runs
+        n_iter_init iterations).
+
+    'margin' - Safety factor applied to the estimate. Power iteration
+        underestimates the spectral norm, the margin keeps the step size
+        on the safe side.
+
+    'exact_every' - If > 0, the exact value is computed every exact_every
+        calls (and at the first one) instead of the estimate.
+    """
+
+    def __init__(self, n_iter=2, n_iter_init=20, margin=1.05, exact_every=0, device='cpu'):
+        self.n_iter = n_iter
+        self.n_iter_init = n_iter_init
+        self.margin = margin
+        self.exact_every = exact_every
+        self.exact = ExactLipschitz(device)
+        self.v_L = None
+        self.v_R = None
+        self.n_calls = 0
+
+    def __call__(self, L, R):
+        n_calls = self.n_calls
+        self.n_calls += 1
+        if self.exact_every > 0 and n_calls % self.exact_every == 0:
+            return self.exact(L, R)
+
+        n_iter = self.n_iter if n_calls else self.n_iter_init
+        self.v_L, norm_L = self._power(L, self.v_L, n_iter)
+        R_t = [adjoint(fact) for fact in reversed(R)]
+        self.v_R, norm_R = self._power(R_t, self.v_R, n_iter)
+        return self.margin * norm_L * norm_R
+
+    @staticmethod
+    def _power(D, v, n_iter):
+        """Power iteration on D'*D, D being in factorized form."""
+        if len(D) == 0:
+            return v, 1.
+        n = D[-1].size(1)
+        if v is None or v.size(0) != n:
+            gen = torch.Generator(device=D[-1].device).manual_seed(0)
+            v = torch.randn(n, 1, generator=gen, dtype=D[-1].dtype, device=D[-1].device)
+            v = v / torch.linalg.norm(v)
+        for _ in range(n_iter):
+            w = mult_right(mult_left(D, v).mH, D).mH
+            w_norm = torch.linalg.norm(w)
+            if w_norm == 0:
+                return v, 0.
+            v = w / w_norm
+        Dv = mult_left(D, v)
+        return v, (Dv.abs()**2).sum(dtype=torch.float64)
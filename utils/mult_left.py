@@ -1,16 +1,16 @@
+from .chain_order import chain_prod
 
 
 def mult_left(D, x):
     """Multiplication by a factorized matrix.
 
     y = mult_left(D,x) computes the product y = D*x with D being in 
-    factorized form. 
+    factorized form. The products are carried out in the cheapest order
+    (see chain_order.chain_plan).
     """
     M = len(D)
     if M == 0:
         y = x
     else:
-        y = D[M-1] @ x
-        for i in range(M-2, -1, -1):
-            y = D[i] @ y
-    return y
\ No newline at end of file
+        y = chain_prod(list(D) + [x])
+    return y
@@ -1,14 +1,16 @@
+from .chain_order import chain_prod
+
+
 def mult_right(x, D):
     """Multiplication by a factorized matrix.
 
     y = mult_right(x, D) computes the product y = x*D with D being in 
-    factorized form. 
+    factorized form. The products are carried out in the cheapest order
+    (see chain_order.chain_plan).
     """
     M = len(D)
     if M == 0:
         y = x
     else:
-        y = x @ D[0]
-        for i in range(1, M):
-            y = y @ D[i]
-    return y
\ No newline at end of file
+        y = chain_prod([x] + list(D))
+    return y
@@ -1,4 +1,4 @@
-import torch
+from .sparse import nnz
 
 
 def nnzero_count(D):
@@ -8,5 +8,5 @@ def nnzero_count(D):
     total_l_0 = 0
     n_layers = len(D)
     for i in range(n_layers):
-        total_l_0 += torch.count_nonzero(D[i])
+        total_l_0 += nnz(D[i])
     return total_l_0
\ No newline at end of file
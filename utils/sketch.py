@@ -0,0 +1,108 @@
+import torch
+
+from .blocked import BlockedData
+from .chain_order import chain_prod
+from .lipschitz import ExactLipschitz
+from .lambda_comp import inner
+from .sparse import adjoint, to_dense
+
+
+class Sketch:
+    """Randomized low-rank sketch of a data matrix.
+
+    sketch = Sketch(X, rank) computes an orthonormal basis Q (m*r) of the
+    approximate range of X by randomized range finding, and B = Q'*X (r*n),
+    so that X ~ Q*B with r = rank + oversample. X is only accessed through
+    the products X*Omega, X'*Y and Q'*X, and || X ||^2 is kept exactly. X
+    may be a BlockedData, whose products are streamed.
+
+    Optional arguments:
+    --------------------------
+
+    'oversample' - Additional columns of the random test matrix. The
+        default value is 10.
+
+    'n_power' - Number of power (subspace) iterations, which improve the
+        sketch when the spectrum of X decays slowly. The default value is 1.
+
+    'seed' - Seed of the random test matrix. The default value is 0.
+    """
+
+    def __init__(self, X, rank, oversample=10, n_power=1, seed=0):
+        m, n = X.shape
+        r = min(rank + oversample, m, n)
+        if isinstance(X, BlockedData):
+            mm, tmm, norm2 = X.mm, X.tmm, X.norm2
+        else:
+            mm, tmm, norm2 = X.__matmul__, X.mH.__matmul__, inner(X, X)
+        gen = torch.Generator(device=X.device).manual_seed(seed)
+        Omega = torch.randn(n, r, generator=gen, dtype=X.dtype, device=X.device)
+        Q, _ = torch.linalg.qr(mm(Omega))
+        for _ in range(n_power):
+            Q, _ = torch.linalg.qr(tmm(Q))
+            Q, _ = torch.linalg.qr(mm(Q))
+        self.Q = Q
+        self.B = tmm(Q).mH
+        self.shape = (m, n)
+        self.norm2 = norm2
+
+    def to(self, dtype=None, device=None):
+        """Sketch with Q and B converted to dtype and moved to device."""
+        if self.Q.dtype == dtype and self.Q.device == torch.device(device):
+            return self
+        sketch = Sketch.__new__(Sketch)
+        sketch.Q = self.Q.to(device=device, dtype=dtype)
+        sketch.B = self.B.to(device=device, dtype=dtype)
+        sketch.shape = self.shape
+        sketch.norm2 = self.norm2.to(device)
+        return sketch
+
+    def numel(self):
+        return self.shape[0] * self.shape[1]
+
+    def project(self, L, R):
+        """L'*X*R' for L and R in factorized form, computed as (L'*Q)*(B*R')."""
+        Lt = [adjoint(fact) for fact in reversed(L)]
+        Rt = [adjoint(fact) for fact in reversed(R)]
+        return to_dense(chain_prod(Lt + [self.Q])) @ to_dense(chain_prod([self.B] + Rt))
+
+
+def _gram_prod(L, S, R):
+    """(L'*L)*S*(R*R') for L and R in factorized form."""
+    GS = S
+    if L:
+        Lt = [adjoint(fact) for fact in reversed(L)]
+        GS = to_dense(chain_prod(Lt + L)) @ GS
+    if R:
+        Rt = [adjoint(fact) for fact in reversed(R)]
+        GS = GS @ to_dense(chain_prod(R + Rt))
+    return GS
+
+
+def grad_comp_sketch(L, S, R, sketch, lambda_, device='cpu', lipschitz=None):
+    """Computation of the gradient and Lipschitz modulus on a sketch
+
+    [grad, LC] = grad_comp_sketch(L,S,R,sketch,lambda) computes the gradient
+    grad of H(L,S,R,lambda) = || X - lambda*L*S*R || as in grad_comp, X being
+    replaced by its sketch Q*B:
+        grad = lambda^2*(L'*L)*S*(R*R') - lambda*(L'*Q)*(B*R')
+    No m*n temporary is formed. sketch may also be a BlockedData, for which
+    L'*X*R' is streamed over the blocks of X (the gradient is then exact).
+    """
+    S = to_dense(S)
+    grad = lambda_**2 * _gram_prod(L, S, R) - lambda_ * sketch.project(L, R)
+
+    # Compute the Lipschitz constant
+    if lipschitz is None:
+        lipschitz = ExactLipschitz(device)
+    LC = lambda_**2 * lipschitz(L, R)
+    return grad, LC
+
+
+def lambda_comp_sketch(L, S, R, sketch):
+    """lambda_comp on a sketch: XD = <(L'*Q)*(B*R'), S> and
+    DD = <(L'*L)*S*(R*R'), S>, accumulated in float64."""
+    S = to_dense(S)
+    XD = inner(S, sketch.project(L, R))
+    DD = inner(S, _gram_prod(L, S, R))
+    return XD / DD, XD, DD
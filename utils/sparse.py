@@ -0,0 +1,73 @@
+import torch
+
+
+LAYOUTS = {
+    'csr': torch.sparse_csr,
+    'coo': torch.sparse_coo,
+}
+
+
+def is_sparse(x):
+    """True if x is a tensor stored in a sparse layout."""
+    return torch.is_tensor(x) and x.layout != torch.strided
+
+
+def to_dense(x):
+    """Dense (strided) version of x."""
+    if is_sparse(x):
+        return x.to_dense()
+    return x
+
+
+def to_sparse(x, sparse_format='csr'):
+    """Sparse version of the matrix x in the format 'csr' or 'coo'."""
+    if sparse_format not in LAYOUTS:
+        raise Exception(f'The expressed sparse format is not known: {sparse_format}')
+    if x.layout == LAYOUTS[sparse_format]:
+        return x
+    x = to_dense(x)
+    if sparse_format == 'csr':
+        return x.to_sparse_csr()
+    return x.to_sparse().coalesce()
+
+
+def nnz(x):
+    """Number of non-zero entries of x, whatever its layout."""
+    if x.layout == torch.sparse_coo:
+        return int((x.coalesce().values() != 0).sum())
+    if is_sparse(x):
+        return int((x.values() != 0).sum())
+    return int(torch.count_nonzero(x))
+
+
+def density(x):
+    return nnz(x) / x.numel() if x.numel() else 0.
+
+
+def sparsify(x, threshold, sparse_format='csr'):
+    """Storage of x switched to sparse if its density is below threshold.
+
+    y = sparsify(x, threshold) returns x in the sparse format sparse_format
+    if its proportion of non-zero entries is lower than threshold, and in
+    dense format otherwise.
+    """
+    if threshold <= 0 or not torch.is_tensor(x) or x.ndim != 2:
+        return x
+    if density(x) < threshold:
+        return to_sparse(x, sparse_format)
+    return to_dense(x)
+
+
+def transpose(x):
+    """Transpose of the matrix x, whatever its layout (CSR gives CSC)."""
+    return x.mT
+
+
+def adjoint(x):
+    """Conjugate transpose of the matrix x, whatever its layout (the
+    transpose of a real matrix)."""
+    if not x.is_complex():
+        return transpose(x)
+    if is_sparse(x):
+        return transpose(x).conj_physical()
+    return x.mH
@@ -0,0 +1,67 @@
+import time
+
+import torch
+
+from .sparse import to_dense
+
+
+class StoppingCriterion:
+    """Stopping criteria of PALM, evaluated once per iteration.
+
+    stop = StoppingCriterion(...); reason = stop(rel_error, facts) returns
+    None while the iterations should go on, and the reason of the stop
+    otherwise. The relative error is given by the caller (see
+    lambda_comp/error_comp), so that nothing is developed here.
+
+    'tol_obj' - Stop when the relative change of the objective
+        || X - lambda*D ||^2 between two iterations is lower than tol_obj
+        (reason 'tol_obj'). Disabled if 0.
+
+    'tol_err' - Stop when the relative error || X - lambda*D || / || X || is
+        lower than tol_err (reason 'tol_err'). Disabled if 0.
+
+    'support_stable' - Stop when the supports of the factors have not
+        changed during support_stable consecutive iterations (reason
+        'support'). Disabled if 0.
+
+    'max_time' - Stop when the time elapsed since the creation of the
+        criterion exceeds max_time seconds (reason 'max_time'). Disabled if 0.
+    """
+
+    def __init__(self, tol_obj=0, tol_err=0, support_stable=0, max_time=0):
+        self.tol_obj = tol_obj
+        self.tol_err = tol_err
+        self.support_stable = support_stable
+        self.max_time = max_time
+        self.start = time.perf_counter()
+        self.obj = None
+        self.supports = None
+        self.n_stable = 0
+
+    def __bool__(self):
+        return bool(self.tol_obj or self.tol_err or self.support_stable or self.max_time)
+
+    def __call__(self, rel_error, facts):
+        rel_error = float(rel_error)
+        obj, self.obj = self.obj, rel_error**2
+        if self.tol_err and rel_error < self.tol_err:
+            return 'tol_err'
+        if self.tol_obj and obj is not None and abs(obj - self.obj) <= self.tol_obj * max(obj, 1e-300):
+            return 'tol_obj'
+        if self.support_stable:
+            supports = [self._support(fact) for fact in facts]
+            if self.supports is not None and all(
+                    s.shape == s_old.shape and torch.equal(s, s_old) for s, s_old in zip(supports, self.supports)):
+                self.n_stable += 1
+            else:
+                self.n_stable = 0
+            self.supports = supports
+            if self.n_stable >= self.support_stable:
+                return 'support'
+        if self.max_time and time.perf_counter() - self.start > self.max_time:
+            return 'max_time'
+        return None
+
+    @staticmethod
+    def _support(fact):
+        return to_dense(fact) != 0
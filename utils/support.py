@@ -0,0 +1,114 @@
+import torch
+
+
+class Support:
+    """Fixed support of a factor.
+
+    support = Support(mask) describes the support of the m*n boolean matrix
+    mask: the flat indices of its entries 'index', and their rows and
+    columns. Block-diagonal supports also keep their blocks, so that the
+    products restricted to the support are block matmuls.
+
+    Support.blockdiag(m, n, n_blocks) and Support.butterfly(n, level) build
+    the block-diagonal and butterfly supports of the constraints 'blockdiag'
+    and 'butterfly' of palm4msa.
+    """
+
+    def __init__(self, mask, blocks=None):
+        mask = torch.as_tensor(mask, dtype=torch.bool)
+        self.shape = tuple(mask.shape)
+        self.rows, self.cols = mask.nonzero(as_tuple=True)
+        self.index = self.rows * self.shape[1] + self.cols
+        self.blocks = blocks
+
+    def numel(self):
+        return self.index.numel()
+
+    def to(self, device):
+        """Support with its indices moved to device."""
+        support = Support.__new__(Support)
+        support.shape, support.blocks = self.shape, self.blocks
+        support.rows, support.cols, support.index = self.rows.to(device), self.cols.to(device), self.index.to(device)
+        return support
+
+    def values(self, A):
+        """Entries of the dense matrix A on the support, in the order of index."""
+        return A.reshape(-1)[self.index]
+
+    def scatter(self, values, out=None):
+        """Dense matrix holding values on the support and zeros elsewhere,
+        written into out if given."""
+        if out is None:
+            out = torch.zeros(self.shape, dtype=values.dtype, device=values.device)
+        else:
+            out.zero_()
+        out.view(-1)[self.index] = values.to(out.dtype)
+        return out
+
+    @classmethod
+    def blockdiag(cls, m, n, n_blocks):
+        """n_blocks diagonal blocks of size (m/n_blocks)*(n/n_blocks)."""
+        if m % n_blocks or n % n_blocks:
+            raise Exception(f'A {m}*{n} matrix cannot be split in {n_blocks} diagonal blocks')
+        p, q = m // n_blocks, n // n_blocks
+        blocks = [(slice(b*p, (b+1)*p), slice(b*q, (b+1)*q)) for b in range(n_blocks)]
+        mask = torch.zeros(m, n, dtype=torch.bool)
+        for rows, cols in blocks:
+            mask[rows, cols] = True
+        return cls(mask, blocks)
+
+    @classmethod
+    def butterfly(cls, n, level):
+        """Support kron(I_{n/2^level}, kron(ones(2,2), I_{2^(level-1)})) of the
+        level-th butterfly factor of size n = 2^p (1 <= level <= p), which
+        has 2 entries per row and column. The product of the n-by-n
+        butterfly factors of levels 1 to p has a full support (e.g. the
+        Hadamard matrix)."""
+        if n & (n - 1) or not 2 <= 2**level <= n:
+            raise Exception(f'No butterfly support of level {level} for size {n}')
+        mask = torch.kron(torch.eye(n // 2**level), torch.kron(torch.ones(2, 2), torch.eye(2**(level-1))))
+        return cls(mask)
+
+    def restrict(self, A):
+        """Dense matrix equal to A on the support and zero elsewhere."""
+        return self.scatter(self.values(A))
+
+    def mm(self, A, B, chunk=2**24):
+        """A*B restricted to the support (zero elsewhere), computed on the
+        support only: one matmul per block for block-diagonal supports, and
+        the sampled product of sample otherwise."""
+        out = torch.zeros(self.shape, dtype=torch.result_type(A, B), device=A.device)
+        if self.blocks is not None:
+            for rows, cols in self.blocks:
+                out[rows, cols] = A[rows] @ B[:, cols]
+            return out
+        out.view(-1)[self.index] = self.sample(A, B, chunk)
+        return out
+
+    def sample(self, A, B, chunk=2**24):
+        """Entries of A*B on the support, in the order of index (sampled
+        dense-dense product): dot products of the gathered rows of A and
+        columns of B, by chunks of about chunk scalars."""
+        if self.blocks is not None:
+            return self.values(self.mm(A, B))
+        Bt = B.T
+        step = max(chunk // A.size(1), 1)
+        values = torch.empty(self.numel(), dtype=torch.result_type(A, B), device=A.device)
+        for start in range(0, self.numel(), step):
+            stop = start + step
+            values[start:stop] = (A[self.rows[start:stop]] * Bt[self.cols[start:stop]]).sum(-1)
+        return values
+
+
+def constraint_support(cons):
+    """Support of the structured constraint cons ('blockdiag', 'butterfly'
+    or 'supp'), None for the other constraints."""
+    if cons[0] == 'blockdiag':
+        return Support.blockdiag(cons[2], cons[3], cons[1])
+    if cons[0] == 'butterfly':
+        if cons[2] != cons[3]:
+            raise Exception('Butterfly factors must be square')
+        return Support.butterfly(cons[2], cons[1])
+    if cons[0] == 'supp':
+        return Support(cons[1])
+    return None
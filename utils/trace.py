@@ -0,0 +1,147 @@
+import contextlib
+import json
+import time
+
+import torch
+
+from .sparse import nnz
+
+
+class Tracer:
+    """Structured events and per-phase timings of PALM runs.
+
+    tracer = Tracer(every) records, every 'every' iterations of palm4msa
+    (params.tracer), an event holding the objective, relative error,
+    lambda, number of non-zeros and step size of each factor and the time
+    spent in the gradient, Lipschitz, projection and lambda phases.
+    hierarchical passes it to its PALM runs and tags the events with the
+    level and stage, which are also recorded as spans.
+
+    The iterations which are not sampled cost a test per phase, and a
+    Tracer with every = 0 records nothing.
+
+    'callback' - Function called with each event (a dict) when it is
+        recorded, e.g. to log or plot on the fly.
+
+    'sync' - If True, CUDA is synchronized around each timed phase, so that
+        the timings of asynchronous kernels are accurate.
+
+    The events are exported with to_jsonl (one JSON object per line) or
+    to_chrome_trace (Chrome trace format, for chrome://tracing or
+    Perfetto).
+    """
+
+    PHASES = ('grad', 'lipschitz', 'prox', 'lambda')
+
+    def __init__(self, every=1, callback=None, sync=False):
+        self.every = every
+        self.callback = callback
+        self.sync = sync
+        self.events = []
+        self.spans = []
+        self.tags = {}
+        self.sampling = False
+        self.start = time.perf_counter()
+        self._iter = None
+
+    def __bool__(self):
+        return self.every > 0
+
+    def _now(self):
+        if self.sync and torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return time.perf_counter() - self.start
+
+    def begin_iter(self, i):
+        """Starts iteration i, which is recorded if it is sampled."""
+        self.sampling = self.every > 0 and i % self.every == 0
+        if self.sampling:
+            self._iter = dict(self.tags, event='iter', iter=i, ts=self._now(), phases=[])
+
+    def end_iter(self, lambda_, objective, rel_error, facts, steps):
+        """Records the sampled iteration with its scalars and factors."""
+        if not self.sampling:
+            return
+        event = self._iter
+        event['dur'] = self._now() - event['ts']
+        event['objective'] = float(objective)
+        event['rel_error'] = float(rel_error)
+        event['lambda'] = float(lambda_)
+        event['nnz'] = [nnz(fact) if torch.is_tensor(fact) else None for fact in facts]
+        event['step'] = [None if step is None else float(step) for step in steps]
+        event['time'] = {phase: 0. for phase in self.PHASES}
+        for phase, _, dur, _ in event['phases']:
+            event['time'][phase] += dur
+        # The Lipschitz estimation runs within the gradient computation
+        event['time']['grad'] -= event['time']['lipschitz']
+        self.events.append(event)
+        self.sampling = False
+        if self.callback is not None:
+            self.callback(event)
+
+    @contextlib.contextmanager
+    def _timed(self, name, j):
+        t0 = self._now()
+        yield
+        self._iter['phases'].append((name, t0, self._now() - t0, j))
+
+    def phase(self, name, j=None):
+        """Context timing the phase name (of factor j) of a sampled iteration."""
+        if not self.sampling:
+            return contextlib.nullcontext()
+        return self._timed(name, j)
+
+    def timed(self, name, fn, j=None):
+        """fn, with its calls timed as the phase name of factor j."""
+        if not self.sampling:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            with self._timed(name, j):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    @contextlib.contextmanager
+    def span(self, name, **tags):
+        """Context recording a span (e.g. a stage of hierarchical) and
+        tagging the events recorded within it."""
+        if not self:
+            yield
+            return
+        saved = self.tags
+        self.tags = dict(saved, **tags)
+        t0 = self._now()
+        try:
+            yield
+        finally:
+            event = dict(self.tags, event='span', name=name, ts=t0, dur=self._now() - t0)
+            self.tags = saved
+            self.spans.append(event)
+            if self.callback is not None:
+                self.callback(event)
+
+    def to_jsonl(self, path):
+        """Writes the spans and iteration events as JSON lines, by start time."""
+        with open(path, 'w') as f:
+            for event in sorted(self.spans + self.events, key=lambda event: event['ts']):
+                event = {key: value for key, value in event.items() if key != 'phases'}
+                f.write(json.dumps(event) + '\n')
+
+    def to_chrome_trace(self, path):
+        """Writes the spans, iterations and phases in Chrome trace format."""
+        def us(t):
+            return round(t * 1e6, 3)
+
+        trace = []
+        for event in self.spans:
+            args = {key: value for key, value in event.items() if key not in ('event', 'name', 'ts', 'dur')}
+            trace.append(dict(name=event['name'], ph='X', ts=us(event['ts']), dur=us(event['dur']),
+                              pid=0, tid=0, args=args))
+        for event in self.events:
+            args = {key: value for key, value in event.items() if key not in ('event', 'ts', 'dur', 'phases')}
+            trace.append(dict(name=f'iter {event["iter"]}', ph='X', ts=us(event['ts']), dur=us(event['dur']),
+                              pid=0, tid=0, args=args))
+            for name, ts, dur, j in event['phases']:
+                trace.append(dict(name=name, ph='X', ts=us(ts), dur=us(dur), pid=0, tid=0, args={'factor': j}))
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)